@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Compare the XML-RPC response decoders (see trac2gitlab.decoder) on
+responses shaped like the ones of a crawl: a multicall batch of tickets
+with their changelogs and a large attachment. Runs against the source
+tree, trac2gitlab does not need to be installed:
+
+    python benchmarks/decoder.py --tickets 500 --attachment-size 8388608
+"""
+
+import os
+import sys
+import timeit
+
+import click
+from six.moves import xmlrpc_client as xmlrpc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from trac2gitlab.decoder import DECODERS
+from trac2gitlab.tracserver import generate_project
+
+
+CHUNK_SIZE = 1 << 16
+
+
+def _responses(tickets, attachment_size):
+    project = generate_project(tickets=tickets, changes=10, wiki_pages=0, attachment_ratio=0)
+    batch = []
+    for ticket_id, ticket in sorted(project['tickets'].items()):
+        attributes = ticket['attributes']
+        batch.append([[ticket_id, attributes['time'], attributes['changetime'], attributes]])
+        batch.append([[
+            [c['time'], c['author'], c['field'], c['oldvalue'], c['newvalue'], int(c['permanent'])]
+            for c in ticket['changelog']
+        ]])
+    payload = bytes(bytearray(i % 251 for i in range(attachment_size)))
+    return [
+        ('multicall of {} tickets'.format(tickets), xmlrpc.dumps((batch,), methodresponse=True).encode('utf-8')),
+        ('attachment of {} bytes'.format(attachment_size),
+         xmlrpc.dumps((xmlrpc.Binary(payload),), methodresponse=True).encode('utf-8')),
+    ]
+
+
+def _decode(getparser, data):
+    # Fed in chunks, as the transport does
+    parser, unmarshaller = getparser(use_datetime=True)
+    for i in range(0, len(data), CHUNK_SIZE):
+        parser.feed(data[i:i + CHUNK_SIZE])
+    parser.close()
+    return unmarshaller.close()
+
+
+@click.command()
+@click.option('--tickets', metavar='<int>', type=int, default=200, show_default=True,
+              help='Tickets in the multicall response')
+@click.option('--attachment-size', metavar='<bytes>', type=int, default=4 << 20, show_default=True,
+              help='Size of the attachment response')
+@click.option('--repeat', metavar='<int>', type=int, default=5, show_default=True,
+              help='Runs per decoder, the best one is reported')
+def main(tickets, attachment_size, repeat):
+    for name, data in _responses(tickets, attachment_size):
+        click.echo('{} ({:.1f} MiB):'.format(name, len(data) / float(1 << 20)))
+        timings = {}
+        for decoder in sorted(DECODERS):
+            timings[decoder] = min(timeit.repeat(lambda: _decode(DECODERS[decoder], data), number=1, repeat=repeat))
+        for decoder in sorted(DECODERS):
+            click.echo('  {:<6} {:8.1f} ms {:8.1f} MiB/s {:6.2f}x'.format(
+                decoder, timings[decoder] * 1000, len(data) / timings[decoder] / (1 << 20),
+                timings['stock'] / timings[decoder]))
+
+
+if __name__ == '__main__':
+    main()
@@ -43,6 +43,9 @@ setup(
         'click_spinner',
         'toml',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+    },
     entry_points={
         'console_scripts': [
             'trac2gitlab=trac2gitlab.cli:main',
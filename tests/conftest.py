@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import sqlite3
+import datetime
+
+import pytest
+from click.testing import CliRunner
+
+from trac2gitlab import trac
+from trac2gitlab.cli import cli
+from trac2gitlab.decoder import fast_getparser
+from trac2gitlab.serialize import json_default
+from trac2gitlab.tracserver import TracServer, generate_project
+
+
+def normalized(obj):
+    """Compare exports regardless of datetime and bytes representations"""
+    return json.loads(json.dumps(obj, sort_keys=True, default=json_default))
+
+
+def run_cli(*args):
+    """Run a trac2gitlab command, fail on errors"""
+    result = CliRunner().invoke(cli, list(args), obj={}, catch_exceptions=False)
+    assert result.exit_code == 0, result.output
+    return result
+
+
+def user_pages(project):
+    """Wiki pages of a generated project crawled by default (system pages aside)"""
+    return {name: page for name, page in project['wiki'].items() if page['attributes']['author'] != 'trac'}
+
+
+def _timestamp(value):
+    """Trac >= 0.12 database timestamp: microseconds since the epoch"""
+    if not value:
+        return None
+    return int((value - datetime.datetime(1970, 1, 1)).total_seconds()) * 1000000
+
+
+def write_trac_db(project, env_path):
+    """Write a generated project into the database of a Trac environment,
+    return its Trac connection string"""
+    db_path = os.path.join(env_path, 'db', 'trac.db')
+    os.makedirs(os.path.dirname(db_path))
+    db = sqlite3.connect(db_path)
+    db.executescript('''
+        CREATE TABLE ticket (id integer PRIMARY KEY, type text, time integer, changetime integer, component text,
+            severity text, priority text, owner text, reporter text, cc text, version text, milestone text,
+            status text, resolution text, summary text, description text, keywords text);
+        CREATE TABLE ticket_custom (ticket integer, name text, value text);
+        CREATE TABLE ticket_change (ticket integer, time integer, author text, field text, oldvalue text,
+            newvalue text);
+        CREATE TABLE attachment (type text, id text, filename text, size integer, time integer,
+            description text, author text);
+        CREATE TABLE wiki (name text, version integer, time integer, author text, ipnr text, text text,
+            comment text, readonly integer);
+        CREATE TABLE milestone (name text PRIMARY KEY, due integer, completed integer, description text);
+    ''')
+    for ticket_id, ticket in project['tickets'].items():
+        attributes = ticket['attributes']
+        db.execute('INSERT INTO ticket VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            ticket_id, attributes['type'], _timestamp(attributes['time']), _timestamp(attributes['changetime']),
+            attributes['component'], attributes['severity'], attributes['priority'], attributes['owner'],
+            attributes['reporter'], attributes['cc'], attributes['version'], attributes['milestone'],
+            attributes['status'], attributes['resolution'], attributes['summary'], attributes['description'],
+            attributes['keywords']))
+        for change in ticket['changelog']:
+            if change['field'] != 'attachment':
+                db.execute('INSERT INTO ticket_change VALUES (?, ?, ?, ?, ?, ?)', (
+                    ticket_id, _timestamp(change['time']), change['author'], change['field'], change['oldvalue'],
+                    change['newvalue']))
+        for filename, attachment in ticket['attachments'].items():
+            meta = attachment['attributes']
+            db.execute('INSERT INTO attachment VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                'ticket', str(ticket_id), filename, meta['size'], _timestamp(meta['time']), meta['description'],
+                meta['author']))
+    for pagename, page in project['wiki'].items():
+        for info, text in trac.wiki_page_versions(page):
+            db.execute('INSERT INTO wiki VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                pagename, info['version'], _timestamp(info['lastModified']), info['author'], '127.0.0.1', text,
+                info['comment'], 0))
+        for path, data in page['attachments'].items():
+            db.execute('INSERT INTO attachment VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                'wiki', pagename, path.rpartition('/')[2], len(data), 0, '', ''))
+    for name, milestone in project['milestones'].items():
+        db.execute('INSERT INTO milestone VALUES (?, ?, ?, ?)', (
+            name, _timestamp(milestone['due']) or 0, _timestamp(milestone['completed']) or 0,
+            milestone['description']))
+    db.commit()
+    db.close()
+    return 'sqlite:' + db_path
+
+
+@pytest.fixture
+def project():
+    return generate_project(seed=1, tickets=30, changes=3, wiki_pages=5, wiki_versions=3, milestones=3,
+                            attachment_ratio=0.3, attachment_size=2048)
+
+
+@pytest.fixture
+def server(project):
+    with TracServer(project) as server:
+        yield server
+
+
+@pytest.fixture
+def source(server):
+    return trac.connect(server.url, decoder=fast_getparser)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import time
+import functools
+import threading
+
+from trac2gitlab import trac
+from trac2gitlab.tracserver import TracServer
+
+from .conftest import normalized
+
+
+class _CongestedServer(TracServer):
+    """Trac stand-in getting slower with every request served concurrently"""
+
+    def __init__(self, *args, **kwargs):
+        TracServer.__init__(self, *args, **kwargs)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        with self._lock:
+            self.in_flight += 1
+            delay = 0.002 * self.in_flight ** 2
+        try:
+            time.sleep(delay)
+            return TracServer._marshaled_dispatch(self, data, dispatch_method, path)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def _crawl(server, limit, workers):
+    factory = functools.partial(trac.connect, server.url, monitor=limit)
+    limits = []
+    observe = limit.observe
+
+    def recording_observe(latency, success=True):
+        observe(latency, success)
+        limits.append(limit.limit)
+
+    limit.observe = recording_observe
+    with trac.Pool(factory, workers, limit=limit) as pool:
+        tickets = trac.ticket_get_all(factory(), pool=pool)
+    return tickets, limits
+
+
+def test_limit_grows_on_a_healthy_server(project):
+    limit = trac.AdaptiveLimit(8)
+    with TracServer(project, latency=0.01) as server:
+        tickets, limits = _crawl(server, limit, 8)
+    assert normalized(tickets) == normalized(project['tickets'])
+    assert limits[0] == 1 and max(limits) > 2
+
+
+def test_limit_backs_off_when_latency_grows(project):
+    limit = trac.AdaptiveLimit(16, initial=16)
+    with _CongestedServer(project) as server:
+        tickets, limits = _crawl(server, limit, 16)
+    assert normalized(tickets) == normalized(project['tickets'])
+    assert min(limits) < 16 and limits[-1] < 16
+
+
+def test_errors_back_off():
+    limit = trac.AdaptiveLimit(8, initial=8)
+    for _ in range(limit.MIN_ROUND - 1):
+        limit.observe(0.01)
+    limit.observe(0.01, success=False)
+    assert limit.limit == 4
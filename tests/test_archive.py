@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+from trac2gitlab import archive, trac
+
+from .conftest import run_cli
+
+
+def test_archive_round_trip(source, tmpdir):
+    path = str(tmpdir.join('export.sqlite'))
+    archive.dump(trac.project_iter(source, wiki_history=True), path)
+    assert archive.is_archive(path)
+    with archive.Archive(path) as project:
+        assert trac.project_collect(project) == trac.project_get(source, wiki_history=True)
+
+
+def test_archive_queries(source, project, tmpdir):
+    path = str(tmpdir.join('export.sqlite'))
+    archive.dump(trac.project_iter(source), path)
+    tickets = project['tickets']
+    author = tickets[1]['attributes']['reporter']
+    since = sorted(t['attributes']['changetime'] for t in tickets.values())[len(tickets) // 2]
+    with archive.Archive(path) as exported:
+        assert exported.ticket_ids(author=author) == sorted(
+            ticket_id for ticket_id, ticket in tickets.items() if author in trac._ticket_authors(ticket))
+        assert exported.ticket_ids(since=since) == sorted(
+            ticket_id for ticket_id, ticket in tickets.items() if ticket['attributes']['changetime'] >= since)
+        data = next(a['data'] for t in tickets.values() for a in t['attachments'].values())
+        assert exported.attachment_data(hashlib.sha256(data).hexdigest()) == data
+
+
+def test_json_shards_merge_into_archive(server, source, tmpdir):
+    shards = [str(tmpdir.join('shard{}.json'.format(i))) for i in range(2)]
+    for i, path in enumerate(shards):
+        run_cli('export', '--trac-uri', server.url, '--shard', '{}/2'.format(i), '--out-file', path)
+    path = str(tmpdir.join('merged.sqlite'))
+    run_cli('export-merge', '--out-file', path, *shards)
+    # Attachment payloads are archived as they were crawled, not as their base64 text
+    with archive.Archive(path) as merged:
+        assert trac.project_collect(merged) == trac.project_get(source)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import functools
+
+import pytest
+
+from trac2gitlab import trac
+
+from .conftest import user_pages
+
+
+def _expected_counts(project):
+    counts = collections.Counter(page['attributes']['author'] for page in user_pages(project).values())
+    for ticket in project['tickets'].values():
+        counts[ticket['attributes']['reporter']] += 1
+        counts[ticket['attributes']['owner']] += 1
+        counts.update(change['author'] for change in ticket['changelog'])
+    return counts
+
+
+@pytest.mark.parametrize('batch_size, workers, page_size', [(None, 1, None), (7, 1, None), (5, 3, 10)])
+def test_authors_count(server, source, project, batch_size, workers, page_size):
+    factory = functools.partial(trac.connect, server.url)
+    with trac.Pool(factory, workers) as pool:
+        counts = trac.authors_count(source, batch_size=batch_size, pool=pool if workers > 1 else None,
+                                    page_size=page_size)
+    assert counts == _expected_counts(project)
+
+
+def test_authors_get_matches_project_get(source):
+    assert trac.authors_get(source, batch_size=10) == trac.project_get(source)['authors']
+    assert trac.authors_get(source, from_tickets=False) == sorted(set(
+        page['attributes']['author'] for page in trac.wiki_get_all_pages(source).values()))
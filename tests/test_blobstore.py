@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from trac2gitlab import trac
+from trac2gitlab.blobstore import BlobStore, is_ref
+from trac2gitlab.cli import _load_project
+
+from .conftest import run_cli
+
+
+def _payloads(project):
+    """``(key, data)`` of every ticket and wiki attachment"""
+    for ticket_id, ticket in project['tickets'].items():
+        for filename, attachment in ticket['attachments'].items():
+            yield (ticket_id, filename), attachment['data']
+    for pagename, page in project['wiki'].items():
+        for filename, data in page['attachments'].items():
+            yield (pagename, filename), data
+
+
+@pytest.mark.parametrize('batch_size', [None, 5])
+def test_attachments_are_stored_out_of_band(source, tmpdir, batch_size):
+    store = BlobStore(str(tmpdir.join('blobs')))
+    expected = dict(_payloads(trac.project_get(source)))
+    stored = dict(_payloads(trac.project_get(source, store=store, batch_size=batch_size)))
+    assert set(stored) == set(expected)
+    for key, ref in stored.items():
+        assert is_ref(ref)
+        assert ref['size'] == len(expected[key])
+        assert store.get(ref) == expected[key]
+
+
+def test_identical_payloads_are_stored_once(tmpdir):
+    store = BlobStore(str(tmpdir.join('blobs')))
+    assert store.put(b'same') == store.put(b'same')
+    assert store.put(b'other') != store.put(b'same')
+    files = [name for _, _, names in os.walk(store.root) for name in names]
+    assert len(files) == 2
+
+
+def test_export_attachments_dir(server, source, tmpdir):
+    blobs = str(tmpdir.join('blobs'))
+    path = str(tmpdir.join('export.json'))
+    run_cli('export', '--trac-uri', server.url, '--attachments-dir', blobs, '--out-file', path)
+    store = BlobStore(blobs)
+    expected = dict(_payloads(trac.project_get(source)))
+    for key, ref in _payloads(_load_project(path)):
+        assert store.get(ref) == expected[key]
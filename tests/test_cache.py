@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import logging
+import sqlite3
+
+from trac2gitlab import trac
+from trac2gitlab.cache import ResponseCache
+
+from .conftest import normalized
+
+
+def _crawl(server, path, ticket_ids=None):
+    with ResponseCache(path) as cache:
+        source = trac.connect(server.url, cache=cache)
+        if ticket_ids is None:
+            return trac.ticket_get_all(source), cache.hits
+        return trac.ticket_get_many(source, ticket_ids), cache.hits
+
+
+def _edit(project, ticket_id, summary, ago=0):
+    attributes = project['tickets'][ticket_id]['attributes']
+    attributes['summary'] = summary
+    attributes['changetime'] = datetime.datetime.utcnow() - datetime.timedelta(seconds=ago)
+
+
+def test_unchanged_tickets_are_served_from_cache(server, project, tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    first, hits = _crawl(server, path)
+    assert hits == 0
+    second, hits = _crawl(server, path)
+    assert hits > 0
+    assert normalized(second) == normalized(first)
+
+
+def test_changed_tickets_are_retrieved_again(server, project, tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    _crawl(server, path)
+    _edit(project, 1, 'edited')
+    tickets, _ = _crawl(server, path)
+    assert tickets[1]['attributes']['summary'] == 'edited'
+
+
+def test_partial_crawls_do_not_hide_changes(server, project, tmpdir):
+    path = str(tmpdir.join('cache.db'))
+    _crawl(server, path)
+    # Changetimes only have a one second resolution
+    _edit(project, 1, 'edited 1', ago=5)
+    _edit(project, 2, 'edited 2')
+    # Ticket 2 is now the newest cached one, ticket 1 must still be seen as changed
+    _crawl(server, path, [2])
+    tickets, _ = _crawl(server, path)
+    assert tickets[1]['attributes']['summary'] == 'edited 1'
+    assert tickets[2]['attributes']['summary'] == 'edited 2'
+
+
+def test_new_cache_is_not_discarded(tmpdir, caplog):
+    path = str(tmpdir.join('cache.db'))
+    with caplog.at_level(logging.INFO, logger='trac2gitlab.cache'):
+        ResponseCache(path).close()
+        assert not caplog.records
+        ResponseCache(path).close()
+        assert not caplog.records
+
+
+def test_caches_of_older_versions_are_discarded(tmpdir, caplog):
+    path = str(tmpdir.join('cache.db'))
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE response (method TEXT, args TEXT, validator TEXT, value BLOB)')
+    db.commit()
+    db.close()
+    with caplog.at_level(logging.INFO, logger='trac2gitlab.cache'):
+        with ResponseCache(path) as cache:
+            assert 'older version' in caplog.text
+            columns = [row[1] for row in cache._db.execute('PRAGMA table_info(response)')]
+            assert 'synced' in columns
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import pytest
+from six.moves import xmlrpc_client as xmlrpc
+
+from trac2gitlab import trac
+from trac2gitlab.decoder import fast_getparser, loads, stock_getparser
+
+
+def _native(value):
+    """Stock decoder values turned into the native types of the fast one"""
+    if isinstance(value, xmlrpc.Binary):
+        return value.data
+    if isinstance(value, list):
+        return [_native(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _native(v) for k, v in value.items()}
+    return value
+
+
+RESPONSES = [
+    (42,),
+    ([1, 'two', 3.5, True, False, None],),
+    ({'time': datetime.datetime(2010, 1, 2, 3, 4, 5), 'nested': {'list': [[], {}, ['']]}},),
+    (xmlrpc.Binary(bytes(bytearray(range(256))) * 100),),
+    ([{'methodName': 'ticket.get', 'params': [1]}, {'faultCode': 1, 'faultString': 'oops'}],),
+    (u'unicode é中 <&>',),
+]
+
+
+@pytest.mark.parametrize('params', RESPONSES)
+def test_fast_decoder_matches_stock(params):
+    data = xmlrpc.dumps(params, methodresponse=True, allow_none=True).encode('utf-8')
+    stock, _ = loads(data, getparser=stock_getparser)
+    fast, _ = loads(data, getparser=fast_getparser)
+    assert fast == _native(stock)
+
+
+def test_fast_decoder_untyped_values():
+    data = (b'<?xml version="1.0"?><methodResponse><params><param><value>plain</value></param>'
+            b'</params></methodResponse>')
+    assert loads(data, getparser=fast_getparser)[0] == ('plain',)
+
+
+def test_fast_decoder_fault():
+    data = xmlrpc.dumps(xmlrpc.Fault(404, 'Ticket 1 does not exist.'), methodresponse=True).encode('utf-8')
+    with pytest.raises(xmlrpc.Fault) as e:
+        loads(data, getparser=fast_getparser)
+    assert e.value.faultCode == 404
+
+
+def test_fast_decoder_over_the_wire(server):
+    stock = xmlrpc.ServerProxy(server.url, use_datetime=True)
+    fast = trac.connect(server.url, decoder=fast_getparser)
+    for ticket_id in stock.ticket.query('max=0&order=id')[:5]:
+        assert fast.ticket.get(ticket_id) == _native(stock.ticket.get(ticket_id))
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import functools
+
+import pytest
+
+from trac2gitlab import trac
+from trac2gitlab.journal import Journal
+from trac2gitlab.tracserver import COMPONENTS, PRIORITIES
+from trac2gitlab.transport import ConnectionPool
+
+
+@pytest.mark.parametrize('batch_size', [None, 1, 2, 500])
+def test_milestones(source, project, batch_size):
+    milestones = list(trac.milestone_iter(source, batch_size=batch_size))
+    assert milestones == sorted(project['milestones'].items())
+
+
+@pytest.mark.parametrize('realm, names', [('component', COMPONENTS), ('priority', PRIORITIES)])
+def test_enums_in_name_order(server, source, realm, names):
+    with trac.Pool(functools.partial(trac.connect, server.url), 3) as pool:
+        values = list(trac.ticket_enum_iter(source, realm, batch_size=2, pool=pool))
+    assert [name for name, _ in values] == list(names)
+    assert dict(values) == trac.ticket_enum_get_all(source, realm)
+
+
+def test_enum_batches_round_trips(server):
+    connections = ConnectionPool()
+    source = trac.connect(server.url, connections=connections)
+    trac.ticket_enum_get_all(source, 'component', batch_size=trac.ENUM_BATCH_SIZE)
+    # getAll, then a single multicall
+    assert connections.stats.snapshot()['requests'] == 2
+
+
+def test_journaled_enums(source, project, tmpdir):
+    with Journal(str(tmpdir.join('journal.db'))) as journal:
+        first = trac.milestone_get_all(source, batch_size=2, journal=journal)
+        for milestone in project['milestones'].values():
+            milestone['description'] = 'edited'
+        assert trac.milestone_get_all(source, batch_size=2, journal=journal) == first
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+import pytest
+from six import StringIO
+
+from trac2gitlab import trac
+from trac2gitlab.cli import (_dump_json_stream, _dump_jsonl_stream, _iter_json_stream, _iter_jsonl_stream,
+                             _load_project, _project_entries)
+
+from .conftest import normalized, run_cli, user_pages
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 64, 1 << 16])
+def test_json_stream_round_trip(project, chunk_size):
+    f = StringIO()
+    _dump_json_stream(_project_entries(project), f)
+    f.seek(0)
+    assert normalized(trac.project_collect(_iter_json_stream(f, chunk_size=chunk_size))) == normalized(project)
+
+
+def test_json_stream_empty_sections():
+    f = StringIO()
+    _dump_json_stream(iter([]), f)
+    f.seek(0)
+    assert trac.project_collect(_iter_json_stream(f, chunk_size=3)) == trac.project_empty()
+
+
+def test_jsonl_stream_round_trip(project):
+    f = StringIO()
+    _dump_jsonl_stream(_project_entries(project), f)
+    f.seek(0)
+    assert normalized(trac.project_collect(_iter_jsonl_stream(f))) == normalized(project)
+
+
+def test_project_iter_matches_server(source, project):
+    exported = trac.project_collect(trac.project_iter(source, wiki_history=True))
+    assert normalized(exported['wiki']) == normalized(user_pages(project))
+    assert normalized(exported['tickets']) == normalized(project['tickets'])
+    assert normalized(exported['milestones']) == normalized(project['milestones'])
+    assert exported['authors'] == trac._authors_collect(exported['wiki'], exported['tickets'])
+
+
+def test_json_export_reads_back_as_crawled(server, source, tmpdir):
+    path = str(tmpdir.join('export.json'))
+    run_cli('export', '--trac-uri', server.url, '--out-file', path)
+    # Datetimes and attachment payloads get their types back
+    assert _load_project(path) == trac.project_get(source)
+    with open(path) as f:
+        assert trac.project_collect(_iter_json_stream(f, chunk_size=64)) == trac.project_get(source)
+
+
+def test_jsonl_export_reads_back_as_crawled(server, source, tmpdir):
+    path = str(tmpdir.join('export.jsonl'))
+    run_cli('export', '--trac-uri', server.url, '--format', 'jsonl', '--out-file', path)
+    assert _load_project(path) == trac.project_get(source)
+
+
+def test_jsonl_export_to_stdout(server, source):
+    result = run_cli('export', '--trac-uri', server.url, '--format', 'jsonl')
+    # The banner goes to stderr
+    assert trac.project_collect(_iter_jsonl_stream(StringIO(result.stdout))) == trac.project_get(source)
+
+
+@pytest.mark.parametrize('out_name', ['merged.json', 'merged.jsonl', 'merged.sqlite'])
+def test_shard_exports_merge(server, source, tmpdir, out_name):
+    shards = []
+    for i, (format, name) in enumerate([('json', 'shard0.json'), ('jsonl', 'shard1.jsonl'),
+                                        ('sqlite', 'shard2.sqlite')]):
+        shards.append(str(tmpdir.join(name)))
+        run_cli('export', '--trac-uri', server.url, '--shard', '{}/3'.format(i), '--format', format,
+                '--out-file', shards[-1])
+    path = str(tmpdir.join(out_name))
+    run_cli('export-merge', '--out-file', path, *shards)
+    assert _load_project(path) == trac.project_get(source)
+
+
+def test_entities_found_in_several_shards_are_kept_once(server, source, tmpdir, caplog):
+    path = str(tmpdir.join('export.json'))
+    run_cli('export', '--trac-uri', server.url, '--out-file', path)
+    merged = str(tmpdir.join('merged.json'))
+    with caplog.at_level(logging.WARNING, logger='trac2gitlab.cli'):
+        run_cli('export-merge', '--out-file', merged, path, path)
+    assert _load_project(merged) == trac.project_get(source)
+    assert 'found in more than one shard' in caplog.text
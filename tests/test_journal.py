@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+
+import pytest
+
+from trac2gitlab import trac
+from trac2gitlab.cli import _load_project
+from trac2gitlab.journal import Journal
+
+from .conftest import run_cli
+
+
+@pytest.mark.parametrize('batch_size', [None, 5])
+def test_interrupted_crawl_is_resumed(source, project, tmpdir, batch_size):
+    path = str(tmpdir.join('journal.db'))
+    expected = trac.ticket_get_all(source)
+    with Journal(path) as journal:
+        crawled = trac.ticket_iter(source, batch_size=batch_size, journal=journal)
+        done = dict(itertools.islice(crawled, 10))
+        crawled.close()
+    # Journaled tickets are not retrieved again
+    for ticket_id in project['tickets']:
+        project['tickets'][ticket_id]['attributes']['summary'] = 'edited'
+    with Journal(path, resume=True) as journal:
+        tickets = trac.ticket_get_all(source, batch_size=batch_size, journal=journal)
+    assert sorted(tickets) == sorted(expected)
+    for ticket_id, ticket in tickets.items():
+        if ticket_id in done:
+            assert ticket == expected[ticket_id]
+        else:
+            assert ticket['attributes']['summary'] == 'edited'
+
+
+def test_export_resume(server, source, project, tmpdir):
+    journal = str(tmpdir.join('journal.db'))
+    first = str(tmpdir.join('first.json'))
+    run_cli('export', '--trac-uri', server.url, '--journal', journal, '--out-file', first)
+    project['tickets'][1]['attributes']['summary'] = 'edited'
+    resumed = str(tmpdir.join('resumed.json'))
+    run_cli('export', '--trac-uri', server.url, '--journal', journal, '--resume', '--out-file', resumed)
+    assert _load_project(resumed) == _load_project(first)
+    again = str(tmpdir.join('again.json'))
+    run_cli('export', '--trac-uri', server.url, '--journal', journal, '--no-resume', '--out-file', again)
+    assert _load_project(again) == trac.project_get(source)
+    assert _load_project(again)['tickets'][1]['attributes']['summary'] == 'edited'
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import functools
+
+from trac2gitlab import trac
+from trac2gitlab.decoder import fast_getparser
+from trac2gitlab.tracserver import TracServer
+
+
+def _lane(server, **kwargs):
+    return trac.AttachmentLane(functools.partial(trac.connect, server.url, decoder=fast_getparser), **kwargs)
+
+
+def test_lane_completes_every_ticket(server, source):
+    with _lane(server, workers=3) as lane:
+        tickets = dict(trac.ticket_iter(source, batch_size=4, lane=lane))
+    assert tickets == trac.ticket_get_all(source)
+    assert not lane.report
+
+
+def test_oversized_attachments(server, source, project):
+    sizes = sorted(len(a['data']) for t in project['tickets'].values() for a in t['attachments'].values())
+    max_size = sizes[len(sizes) // 2]
+    with _lane(server, max_size=max_size, skip_oversized=True) as lane:
+        tickets = trac.ticket_get_all(source, lane=lane)
+    expected = trac.ticket_get_all(source)
+    skipped = {(entry['ticket'], entry['filename']) for entry in lane.report}
+    assert skipped and all(entry['action'] == 'skipped' for entry in lane.report)
+    for ticket_id, ticket in tickets.items():
+        for filename, attachment in ticket['attachments'].items():
+            data = expected[ticket_id]['attachments'][filename]['data']
+            assert attachment['data'] == (None if (ticket_id, filename) in skipped else data)
+    with _lane(server, max_size=max_size) as lane:
+        assert trac.ticket_get_all(source, lane=lane) == expected
+    assert {entry['action'] for entry in lane.report} == {'deferred'}
+
+
+def test_pending_tickets_are_capped(project, source):
+    # Downloads are slower than the crawl
+    with TracServer(project, latency=0.05) as slow, _lane(slow, workers=1, max_pending=2) as lane:
+        pending = []
+        schedule = lane.schedule
+
+        def recording_schedule(ticket_id, ticket):
+            scheduled = schedule(ticket_id, ticket)
+            pending.append(lane._pending)
+            return scheduled
+
+        lane.schedule = recording_schedule
+        tickets = trac.ticket_get_all(source, lane=lane)
+    assert tickets == trac.ticket_get_all(source)
+    assert max(pending) <= 3
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+import pytest
+from six.moves import xmlrpc_client as xmlrpc
+
+from trac2gitlab import trac
+from trac2gitlab.retry import CircuitBreaker, Retrier, RetryPolicy
+from trac2gitlab.transport import ConnectionPool
+
+
+@pytest.mark.parametrize('page_size', [1, 7, 10, 29, 30, 31, 1000])
+def test_ticket_iter_ids_pages(source, project, page_size):
+    assert list(trac.ticket_iter_ids(source, page_size=page_size)) == sorted(project['tickets'])
+
+
+def test_full_last_page_is_not_an_error(server, project, caplog):
+    retrier = Retrier(fault_policy=RetryPolicy(retries=3, base_delay=0), breaker=CircuitBreaker(window=2))
+    source = trac.connect(server.url, connections=ConnectionPool(), retrier=retrier)
+    with caplog.at_level(logging.WARNING):
+        # 30 tickets, the 4th page is past the last one
+        assert len(list(trac.ticket_iter_ids(source, page_size=10))) == len(project['tickets'])
+    assert not caplog.records
+    assert retrier.stats.snapshot()['fault_retries'] == 0
+    assert retrier.stats.snapshot()['breaker_trips'] == 0
+
+
+class _FaultyQuery(object):
+
+    def __init__(self, source, page):
+        self.ticket = self
+        self._source = source
+        self._page = page
+
+    def query(self, query):
+        if 'page={}&'.format(self._page) in query:
+            raise xmlrpc.Fault(1, 'database is locked')
+        return self._source.ticket.query(query)
+
+
+def test_other_faults_end_nothing(source):
+    with pytest.raises(xmlrpc.Fault):
+        list(trac.ticket_iter_ids(_FaultyQuery(source, 2), page_size=10))
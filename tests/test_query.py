@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import pytest
+
+from trac2gitlab import trac
+from trac2gitlab.cli import _load_project
+
+from .conftest import run_cli
+
+
+def _matching(project, predicate):
+    return sorted(ticket_id for ticket_id, ticket in project['tickets'].items()
+                  if predicate(ticket['attributes']))
+
+
+def test_query_string():
+    query = trac.ticket_query(ids=[1, (3, 5)], components=['a&b', 'c|d\\e'], statuses=['new'],
+                              created=(datetime.datetime(2020, 1, 2, 3, 4, 5), None))
+    assert query == 'id=1|3-5&component=a\\&b|c\\|d\\\\e&status=new&time=2020-01-02T03:04:05Z..'
+    assert trac.ticket_query(created=(None, None), changed=None) == ''
+
+
+@pytest.mark.parametrize('page_size', [None, 4])
+def test_ids_and_ranges(source, page_size):
+    query = trac.ticket_query(ids=[2, (5, 8), 30, 31])
+    assert list(trac.ticket_iter_ids(source, page_size=page_size, query=query)) == [2, 5, 6, 7, 8, 30]
+
+
+@pytest.mark.parametrize('field, option', [('component', 'components'), ('milestone', 'milestones'),
+                                           ('status', 'statuses')])
+def test_field_filters(source, project, field, option):
+    values = sorted(set(ticket['attributes'][field] for ticket in project['tickets'].values()))[:2]
+    query = trac.ticket_query(**{option: values})
+    assert trac.ticket_get_all_ids(source, query=query) == \
+        _matching(project, lambda attributes: attributes[field] in values)
+
+
+def test_escaped_values(source, project):
+    for ticket_id in (3, 4):
+        project['tickets'][ticket_id]['attributes']['component'] = 'a&b|c\\d'
+    query = trac.ticket_query(components=['a&b|c\\d', 'a'])
+    assert trac.ticket_get_all_ids(source, query=query) == [3, 4]
+
+
+@pytest.mark.parametrize('field, option', [('time', 'created'), ('changetime', 'changed')])
+def test_time_ranges(source, project, field, option):
+    times = sorted(ticket['attributes'][field] for ticket in project['tickets'].values())
+    since, until = times[5], times[20]
+    for bounds, predicate in [
+            ((since, until), lambda t: since <= t < until),
+            ((since, None), lambda t: since <= t),
+            ((None, until), lambda t: t < until)]:
+        query = trac.ticket_query(**{option: bounds})
+        assert trac.ticket_get_all_ids(source, query=query) == \
+            _matching(project, lambda attributes: predicate(attributes[field]))
+
+
+def test_filtered_export(server, project, tmpdir):
+    component = project['tickets'][1]['attributes']['component']
+    path = str(tmpdir.join('export.json'))
+    run_cli('export', '--trac-uri', server.url, '--out-file', path,
+            '--ticket-ids', '1,3-20', '--component', component)
+    exported = _load_project(path)
+    assert sorted(exported['tickets']) == \
+        [ticket_id for ticket_id in _matching(project, lambda attributes: attributes['component'] == component)
+         if ticket_id == 1 or 3 <= ticket_id <= 20]
+    assert exported['milestones'] == project['milestones']
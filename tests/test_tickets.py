@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from trac2gitlab import trac
+from trac2gitlab.transport import ConnectionPool
+
+from .conftest import normalized
+
+
+def test_ticket_get_batch_matches_ticket_get(source, project):
+    ticket_ids = sorted(project['tickets'])[:12]
+    assert trac.ticket_get_batch(source, ticket_ids) == {
+        ticket_id: trac.ticket_get(source, ticket_id) for ticket_id in ticket_ids
+    }
+    assert normalized(trac.ticket_get_batch(source, ticket_ids)) == normalized(
+        {ticket_id: project['tickets'][ticket_id] for ticket_id in ticket_ids})
+
+
+def test_ticket_get_batch_round_trips(server, project):
+    connections = ConnectionPool()
+    source = trac.connect(server.url, connections=connections)
+    with_attachments = [t for t in sorted(project['tickets']) if project['tickets'][t]['attachments']]
+    trac.ticket_get_batch(source, with_attachments)
+    assert connections.stats.snapshot()['requests'] == 2
+    trac.ticket_get_batch(source, with_attachments, download=False)
+    trac.ticket_get_batch(source, with_attachments, attachments=False)
+    assert connections.stats.snapshot()['requests'] == 4
+
+
+@pytest.mark.parametrize('batch_size', [None, 1, 7, 100])
+def test_ticket_get_all_batch_sizes(source, project, batch_size):
+    assert normalized(trac.ticket_get_all(source, batch_size=batch_size)) == normalized(project['tickets'])
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from trac2gitlab import trac
+from trac2gitlab.decoder import fast_getparser
+
+tracasync = pytest.importorskip('trac2gitlab.tracasync')
+pytest.importorskip('aiohttp')
+
+
+@pytest.mark.parametrize('batch_size, page_size', [(None, None), (7, None), (5, 8)])
+def test_project_get_matches_threads(server, source, batch_size, page_size):
+    async_source = tracasync.connect(server.url, concurrency=4, gzip_requests=True, decoder=fast_getparser)
+    project = tracasync.run(async_source, tracasync.project_get, batch_size=batch_size, page_size=page_size)
+    assert project == trac.project_get(source)
+    assert async_source.compression.enabled
+
+
+def test_windows_keep_id_order(server, source):
+    async_source = tracasync.connect(server.url, decoder=fast_getparser)
+
+    async def crawl(s):
+        wiki = [name async for name, _ in tracasync.wiki_iter(s, window=2)]
+        tickets = [ticket_id async for ticket_id, _ in tracasync.ticket_iter(s, window=3)]
+        return wiki, tickets
+
+    wiki, tickets = tracasync.run(async_source, crawl)
+    assert wiki == sorted(trac.wiki_get_all_pages(source))
+    assert tickets == sorted(trac.ticket_get_all(source))
+
+
+def test_iterate_stops_early(server, source):
+    async_source = tracasync.connect(server.url, concurrency=2, decoder=fast_getparser)
+    entries = tracasync.iterate(async_source, tracasync.project_iter)
+    section, name, page = next(entries)
+    entries.close()
+    assert section == 'wiki'
+    assert page == trac.wiki_get_all_pages(source)[name]
+    assert async_source.session is None
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from trac2gitlab import trac, tracdb
+from trac2gitlab.cli import _load_project
+
+from .conftest import normalized, run_cli, write_trac_db
+
+
+def _comparable(project):
+    """Project regardless of attachment payloads (not in the database), of
+    the raw changetime and of the order of the changes made at once"""
+    project = normalized(project)
+    for ticket in project['tickets'].values():
+        ticket['attributes'].pop('_ts')
+        ticket['changelog'].sort(key=lambda c: (c['time'], c['permanent'], c['author'], c['field']))
+        for attachment in ticket['attachments'].values():
+            attachment['data'] = None
+    for page in project['wiki'].values():
+        page['attachments'] = {filename: None for filename in page['attachments']}
+    return project
+
+
+@pytest.fixture
+def trac_db(project, tmpdir):
+    return write_trac_db(project, str(tmpdir))
+
+
+def test_project_get_matches_server(source, trac_db):
+    read = tracdb.project_get(tracdb.connect(trac_db), wiki_history=True)
+    assert _comparable(read) == _comparable(trac.project_get(source, wiki_history=True))
+
+
+def test_shards_cover_the_project(trac_db):
+    db = tracdb.connect(trac_db)
+    whole = trac.project_collect(tracdb.project_iter(db, collect_authors=False))
+    shards = [trac.project_collect(tracdb.project_iter(db, collect_authors=False, shard=(i, 3))) for i in range(3)]
+    for section in ('wiki', 'tickets'):
+        assert sorted(key for shard in shards for key in shard[section]) == sorted(whole[section])
+    assert shards[0]['milestones'] == whole['milestones']
+    assert not shards[1]['milestones']
+
+
+def test_authors_count_matches_server(source, trac_db):
+    assert tracdb.authors_count(tracdb.connect(trac_db)) == trac.authors_count(source)
+
+
+def test_export_trac_db(source, trac_db, tmpdir):
+    path = str(tmpdir.join('export.json'))
+    run_cli('export', '--trac-db', trac_db, '--out-file', path)
+    assert _comparable(_load_project(path)) == _comparable(trac.project_get(source))
+
+
+def test_rows_are_streamed_through_named_cursors(trac_db):
+    cursors = {}
+
+    class Cursor(object):
+
+        def __init__(self, cursor):
+            self._cursor = cursor
+            self.itersize = None
+
+        def execute(self, sql):
+            return self._cursor.execute(sql)
+
+        def __iter__(self):
+            return iter(self._cursor)
+
+    class Connection(object):
+        """Stands for a psycopg2 connection, whose named cursors are server-side ones"""
+
+        def __init__(self, db):
+            self._db = db
+
+        def cursor(self, name=None):
+            cursor = cursors[name] = Cursor(self._db.cursor())
+            return cursor
+
+    db = tracdb.connect(trac_db)
+    assert list(tracdb.ticket_iter(Connection(db))) == list(tracdb.ticket_iter(db))
+    assert cursors['tickets'].itersize == cursors['ticket_changes'].itersize == tracdb.CURSOR_ITERSIZE
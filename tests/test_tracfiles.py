@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import logging
+
+import pytest
+
+from trac2gitlab import trac, tracdb
+from trac2gitlab.tracfiles import AttachmentFiles
+
+from .conftest import write_trac_db
+
+
+def _write(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def write_attachment_files(project, env_path, legacy=False):
+    """Write the attachments of a generated project in the ``files``
+    (hashed) or ``attachments`` (legacy) tree of a Trac environment"""
+    files = AttachmentFiles(env_path)
+    path = files._legacy_path if legacy else files._hashed_path
+    for ticket_id, ticket in project['tickets'].items():
+        for filename, attachment in ticket['attachments'].items():
+            _write(path('ticket', str(ticket_id), filename), attachment['data'])
+    for pagename, page in project['wiki'].items():
+        for filename, data in page['attachments'].items():
+            _write(path('wiki', pagename, filename.rpartition('/')[2]), data)
+    return files
+
+
+def _payloads(project):
+    payloads = {}
+    for ticket_id, ticket in project['tickets'].items():
+        for filename, attachment in ticket['attachments'].items():
+            payloads[ticket_id, filename] = attachment['data']
+    for page in project['wiki'].values():
+        payloads.update(page['attachments'])
+    return payloads
+
+
+@pytest.fixture
+def served(project):
+    """Copy of the project whose attachments are served by XML-RPC with
+    different payloads, to tell where they come from"""
+    served = copy.deepcopy(project)
+    for ticket in served['tickets'].values():
+        for attachment in ticket['attachments'].values():
+            attachment['data'] = b'xmlrpc'
+    for page in served['wiki'].values():
+        page['attachments'] = {filename: b'xmlrpc' for filename in page['attachments']}
+    return served
+
+
+@pytest.mark.parametrize('legacy', [False, True])
+def test_attachments_are_read_from_the_environment(server, project, served, tmpdir, legacy):
+    files = write_attachment_files(project, str(tmpdir), legacy=legacy)
+    server.project = served
+    source = trac.connect(server.url)
+    for batch_size in (None, 5):
+        crawled = trac.project_get(source, files=files, batch_size=batch_size)
+        assert _payloads(crawled) == {key: data for key, data in _payloads(project).items()
+                                      if key in _payloads(crawled)}
+        assert _payloads(crawled) and b'xmlrpc' not in _payloads(crawled).values()
+
+
+def test_missing_files_fall_back_to_xmlrpc(server, project, served, tmpdir, caplog):
+    files = write_attachment_files(project, str(tmpdir))
+    ticket_id, ticket = next((i, t) for i, t in sorted(project['tickets'].items()) if t['attachments'])
+    filename = sorted(ticket['attachments'])[0]
+    os.remove(files.path('ticket', ticket_id, filename))
+    server.project = served
+    with caplog.at_level(logging.WARNING, logger='trac2gitlab.trac'):
+        crawled = trac.ticket_get(trac.connect(server.url), ticket_id, files=files)
+    assert crawled['attachments'][filename]['data'] == b'xmlrpc'
+    assert 'falling back to XML-RPC' in caplog.text
+
+
+def test_hashed_and_legacy_paths(tmpdir):
+    files = AttachmentFiles(str(tmpdir))
+    filename = u'résumé final.PDF'
+    hashed = files._hashed_path('ticket', u'42', filename)
+    assert hashed.startswith(os.path.join(str(tmpdir), 'files', 'attachments', 'ticket', '92c', '92cfceb39d'))
+    assert hashed.endswith('.PDF')
+    legacy = files._legacy_path('wiki', u'Wiki/Sub Page', filename)
+    assert legacy == os.path.join(str(tmpdir), 'attachments', 'wiki', 'Wiki/Sub%20Page',
+                                  'r%C3%A9sum%C3%A9%20final.PDF')
+    _write(legacy, b'legacy')
+    assert files.read('wiki', u'Wiki/Sub Page', filename) == b'legacy'
+    _write(files._hashed_path('wiki', u'Wiki/Sub Page', filename), b'hashed')
+    assert files.read('wiki', u'Wiki/Sub Page', filename) == b'hashed'
+    with pytest.raises(IOError):
+        files.read('ticket', 42, filename)
+
+
+def test_trac_db_attachments(project, tmpdir):
+    files = write_attachment_files(project, str(tmpdir))
+    db = tracdb.connect(write_trac_db(project, str(tmpdir)))
+    read = tracdb.project_get(db, files=files)
+    payloads = _payloads(project)
+    assert _payloads(read) == {key: payloads[key] for key in _payloads(read)}
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from six.moves import xmlrpc_client as xmlrpc
+
+from trac2gitlab import trac
+from trac2gitlab.tracserver import _RequestHandler
+from trac2gitlab.transport import ConnectionPool
+
+
+def _rejecting(statuses):
+    """Request handler answering compressed requests with the given HTTP
+    statuses, one per request (None to accept them), then accepting them"""
+    statuses = list(statuses)
+    received = []
+
+    class Handler(_RequestHandler):
+
+        def decode_request_content(self, data):
+            encoding = self.headers.get('Content-Encoding', 'identity')
+            received.append(encoding)
+            status = statuses.pop(0) if encoding == 'gzip' and statuses else None
+            if status is None:
+                return _RequestHandler.decode_request_content(self, data)
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    return Handler, received
+
+
+def _crawl(server, handler=None):
+    if handler is not None:
+        server.RequestHandlerClass = handler
+    connections = ConnectionPool()
+    source = trac.connect(server.url, connections=connections)
+    return trac.ticket_get_all(source, batch_size=10), connections
+
+
+def test_requests_and_responses_are_compressed(server, source):
+    handler, received = _rejecting([])
+    tickets, connections = _crawl(server, handler)
+    assert tickets == trac.ticket_get_all(source)
+    assert 'gzip' in received
+    stats = connections.stats.snapshot()
+    # Large responses come back compressed too, over kept alive connections
+    assert stats['bytes_received'] < stats['bytes_decoded']
+    assert stats['connections_opened'] == 1
+    assert stats['connections_reused'] == stats['requests'] - 1
+
+
+def test_transient_rejection_keeps_compression(server, source):
+    handler, received = _rejecting([503])
+    tickets, connections = _crawl(server, handler)
+    assert tickets == trac.ticket_get_all(source)
+    assert connections.compression.enabled
+    assert received.count('gzip') > 1
+
+
+def test_repeated_rejections_disable_compression(server, source):
+    handler, received = _rejecting([415] * 100)
+    tickets, connections = _crawl(server, handler)
+    assert tickets == trac.ticket_get_all(source)
+    assert not connections.compression.enabled
+    assert received.count('gzip') == connections.compression.limit
+
+
+def test_faults_are_not_sent_again_plain(server):
+    connections = ConnectionPool()
+    source = trac.connect(server.url, connections=connections)
+    with pytest.raises(xmlrpc.Fault):
+        source.wiki.getPage('Missing' * 1000)
+    assert connections.stats.snapshot()['requests'] == 1
+    assert connections.compression.enabled
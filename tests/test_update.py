@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from trac2gitlab import trac
+from trac2gitlab.cli import _load_project
+
+from .conftest import run_cli, user_pages
+
+
+def _change(project):
+    """Edit a ticket and a wiki page, delete another ticket, return the time
+    these changes are crawled from"""
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    ticket = project['tickets'][3]['attributes']
+    ticket['summary'] = 'edited'
+    ticket['changetime'] = now
+    del project['tickets'][4]
+    name = sorted(user_pages(project))[0]
+    page = project['wiki'][name]
+    page['page'] = 'edited'
+    page['attributes']['lastModified'] = now
+    return now - datetime.timedelta(seconds=1)
+
+
+def test_project_update_matches_full_crawl(source, project):
+    previous = trac.project_get(source)
+    since = _change(project)
+    updated = trac.project_update(source, previous, since, batch_size=5)
+    assert updated == trac.project_get(source)
+    assert updated['tickets'][3]['attributes']['summary'] == 'edited'
+    assert 4 not in updated['tickets']
+
+
+def test_previous_export_is_updated(server, source, project, tmpdir):
+    previous = str(tmpdir.join('previous.json'))
+    run_cli('export', '--trac-uri', server.url, '--out-file', previous)
+    since = _change(project)
+    path = str(tmpdir.join('export.json'))
+    run_cli('export', '--trac-uri', server.url, '--previous', previous, '--since', since.isoformat(),
+            '--out-file', path)
+    assert _load_project(path) == trac.project_get(source)
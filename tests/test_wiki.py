@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from trac2gitlab import trac
+
+from .conftest import normalized, user_pages
+
+
+@pytest.mark.parametrize('source_text, target_text', [
+    ('', ''),
+    ('', 'a\nb\n'),
+    ('a\nb\n', ''),
+    ('a\nb\nc\n', 'a\nc\n'),
+    ('a\nb\nc\n', 'x\na\nb\ny\nc\nz'),
+    ('no final newline', 'no final newline\n'),
+    ('a\r\nb\r\n', 'a\nb\n'),
+])
+def test_wiki_delta_round_trip(source_text, target_text):
+    assert trac.wiki_patch(source_text, trac.wiki_delta(source_text, target_text)) == target_text
+
+
+def test_wiki_history_round_trip(source, project):
+    pages = trac.wiki_get_all_pages(source, history=True)
+    assert normalized(pages) == normalized(user_pages(project))
+    for name, page in pages.items():
+        versions = trac.wiki_page_versions(page)
+        assert [info['version'] for info, _ in versions] == list(range(1, page['attributes']['version'] + 1))
+        for info, text in versions:
+            assert text == source.wiki.getPageVersion(name, info['version'])
+
+
+def test_wiki_history_batched(source, project):
+    pages = trac.wiki_get_all_pages(source, history=True, batch_size=2)
+    assert normalized(pages) == normalized(user_pages(project))
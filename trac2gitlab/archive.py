@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import datetime
+import sqlite3
+import logging
+
+import six
+
+from .blobstore import is_ref
+from .serialize import json_default, json_object_hook, parse_datetime
+
+
+LOG = logging.getLogger(__name__)
+
+
+_SCHEMA = '''
+CREATE TABLE ticket (
+    id INTEGER PRIMARY KEY,
+    time TEXT,
+    changetime TEXT,
+    reporter TEXT,
+    owner TEXT,
+    status TEXT,
+    component TEXT,
+    milestone TEXT,
+    summary TEXT,
+    attributes TEXT NOT NULL
+);
+CREATE INDEX ticket_time ON ticket (time);
+CREATE INDEX ticket_changetime ON ticket (changetime);
+CREATE INDEX ticket_reporter ON ticket (reporter);
+CREATE INDEX ticket_owner ON ticket (owner);
+
+CREATE TABLE ticket_change (
+    ticket_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    time TEXT,
+    author TEXT,
+    field TEXT,
+    oldvalue TEXT,
+    newvalue TEXT,
+    permanent INTEGER,
+    PRIMARY KEY (ticket_id, seq)
+);
+CREATE INDEX ticket_change_time ON ticket_change (time);
+CREATE INDEX ticket_change_author ON ticket_change (author);
+
+CREATE TABLE wiki_page (
+    name TEXT PRIMARY KEY,
+    version INTEGER,
+    time TEXT,
+    author TEXT,
+    text TEXT,
+    attributes TEXT NOT NULL,
+    history TEXT
+);
+CREATE INDEX wiki_page_time ON wiki_page (time);
+CREATE INDEX wiki_page_author ON wiki_page (author);
+
+CREATE TABLE milestone (
+    name TEXT PRIMARY KEY,
+    due TEXT,
+    completed TEXT,
+    attributes TEXT NOT NULL
+);
+
+CREATE TABLE attachment (
+    realm TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    time TEXT,
+    author TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    attributes TEXT,
+    PRIMARY KEY (realm, parent, filename)
+);
+CREATE INDEX attachment_sha256 ON attachment (sha256);
+CREATE INDEX attachment_author ON attachment (author);
+
+CREATE TABLE blob (
+    sha256 TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE author (
+    name TEXT PRIMARY KEY
+);
+'''
+
+_MAGIC = b'SQLite format 3\x00'
+
+
+def _dumps(value):
+    return json.dumps(value, sort_keys=True, default=json_default)
+
+
+def _loads(text):
+    return None if text is None else json.loads(text, object_hook=json_object_hook)
+
+
+def _time(value):
+    """Times are stored as ISO 8601 text, which sorts chronologically"""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def is_archive(path):
+    """Whether a file is an SQLite archive (rather than a json export)"""
+    with open(path, 'rb') as f:
+        return f.read(len(_MAGIC)) == _MAGIC
+
+
+class Archive(object):
+    """Project export as a single SQLite file.
+
+    Every entity of a project (see trac.project_iter) gets its own rows:
+    tickets and their changelog, wiki pages, milestones and attachments,
+    whose payloads are stored once per SHA-256 in the ``blob`` table.
+    Tickets, changes, wiki pages and attachments are indexed by time and
+    author, so consumers can query the rows they need instead of loading
+    the whole export. Attachments stored out of band (see BlobStore) are
+    archived as references only.
+    """
+
+    # Entities written per transaction, a partial archive stays usable
+    COMMIT_INTERVAL = 1000
+
+    def __init__(self, path, create=False):
+        self.path = path
+        if create and os.path.exists(path):
+            LOG.debug('overwriting archive %s', path)
+            os.remove(path)
+        elif not create and not os.path.isfile(path):
+            raise IOError('no archive at {}'.format(path))
+        self._db = sqlite3.connect(path)
+        if create:
+            self._db.executescript(_SCHEMA)
+            self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def execute(self, sql, params=()):
+        """Run an arbitrary query against the archive"""
+        return self._db.execute(sql, params)
+
+    ############################################################################
+    # writing
+
+    def _put_blob(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        self._db.execute('INSERT OR IGNORE INTO blob (sha256, data) VALUES (?, ?)',
+                         (digest, sqlite3.Binary(data)))
+        return digest, len(data)
+
+    def _put_attachment(self, realm, parent, filename, attributes, data):
+        if data is None:
+            digest, size = None, None
+        elif is_ref(data):
+            digest, size = data['sha256'], data.get('size')
+        else:
+            digest, size = self._put_blob(data)
+        attributes = attributes or {}
+        self._db.execute(
+            'INSERT OR REPLACE INTO attachment (realm, parent, filename, time, author, size, sha256, attributes) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (realm, parent, filename, _time(attributes.get('time')), attributes.get('author'),
+             attributes.get('size', size), digest, _dumps(attributes) if attributes else None)
+        )
+
+    def _put_ticket(self, ticket_id, ticket):
+        attributes = ticket['attributes']
+        self._db.execute('DELETE FROM ticket_change WHERE ticket_id = ?', (ticket_id,))
+        self._db.execute("DELETE FROM attachment WHERE realm = 'ticket' AND parent = ?", (str(ticket_id),))
+        self._db.execute(
+            'INSERT OR REPLACE INTO ticket (id, time, changetime, reporter, owner, status, component, milestone, '
+            'summary, attributes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (ticket_id, _time(attributes.get('time')), _time(attributes.get('changetime')),
+             attributes.get('reporter'), attributes.get('owner'), attributes.get('status'),
+             attributes.get('component'), attributes.get('milestone'), attributes.get('summary'),
+             _dumps(attributes))
+        )
+        self._db.executemany(
+            'INSERT INTO ticket_change (ticket_id, seq, time, author, field, oldvalue, newvalue, permanent) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(ticket_id, seq, _time(change['time']), change['author'], change['field'],
+              change['oldvalue'], change['newvalue'], int(change['permanent']))
+             for seq, change in enumerate(ticket['changelog'])]
+        )
+        for filename, attachment in six.iteritems(ticket['attachments']):
+            self._put_attachment('ticket', str(ticket_id), filename, attachment['attributes'], attachment['data'])
+
+    def _put_wiki_page(self, name, page):
+        attributes = page['attributes']
+        self._db.execute("DELETE FROM attachment WHERE realm = 'wiki' AND parent = ?", (name,))
+        self._db.execute(
+            'INSERT OR REPLACE INTO wiki_page (name, version, time, author, text, attributes, history) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (name, attributes.get('version'), _time(attributes.get('lastModified')), attributes.get('author'),
+             page.get('page'), _dumps(attributes), _dumps(page['history']) if 'history' in page else None)
+        )
+        for filename, data in six.iteritems(page.get('attachments', {})):
+            # Wiki attachments come without attributes, keyed "<pagename>/<filename>"
+            self._put_attachment('wiki', name, filename, None, data)
+
+    def _put_milestone(self, name, milestone):
+        self._db.execute(
+            'INSERT OR REPLACE INTO milestone (name, due, completed, attributes) VALUES (?, ?, ?, ?)',
+            (name, _time(milestone.get('due')), _time(milestone.get('completed')), _dumps(milestone))
+        )
+
+    def put(self, section, key, value):
+        """Store one ``(section, key, value)`` entry (see trac.project_iter)"""
+        if section == 'tickets':
+            self._put_ticket(key, value)
+        elif section == 'wiki':
+            self._put_wiki_page(key, value)
+        elif section == 'milestones':
+            self._put_milestone(key, value)
+        elif section == 'authors':
+            self._db.execute('DELETE FROM author')
+            self._db.executemany('INSERT OR IGNORE INTO author (name) VALUES (?)', [(a,) for a in value])
+        else:
+            raise ValueError('unknown project section {!r}'.format(section))
+
+    def write(self, entries):
+        """Store ``(section, key, value)`` entries as they come"""
+        count = 0
+        for section, key, value in entries:
+            self.put(section, key, value)
+            count += 1
+            if count % self.COMMIT_INTERVAL == 0:
+                LOG.debug('archived %s entities', count)
+                self._db.commit()
+        self._db.commit()
+        LOG.debug('archived %s entities into %s', count, self.path)
+
+    ############################################################################
+    # reading
+
+    def _attachments(self, realm, parent):
+        rows = self._db.execute(
+            'SELECT a.filename, a.size, a.sha256, a.attributes, b.data FROM attachment a '
+            'LEFT JOIN blob b ON b.sha256 = a.sha256 WHERE a.realm = ? AND a.parent = ? ORDER BY a.filename',
+            (realm, parent)
+        )
+        for filename, size, digest, attributes, data in rows:
+            if data is not None:
+                data = six.binary_type(data)
+            elif digest is not None:
+                # Stored out of band
+                data = {'sha256': digest, 'size': size}
+            yield filename, _loads(attributes), data
+
+    def attachment_data(self, sha256):
+        """Payload of an archived attachment, None if it is stored out of band"""
+        row = self._db.execute('SELECT data FROM blob WHERE sha256 = ?', (sha256,)).fetchone()
+        return six.binary_type(row[0]) if row is not None else None
+
+    def ticket_ids(self, author=None, since=None, until=None):
+        """Ids of the tickets, optionally only the ones reported, owned or
+        changed by ``author`` and last changed from ``since`` on and
+        before ``until``"""
+        sql = 'SELECT id FROM ticket WHERE 1'
+        params = []
+        if author is not None:
+            sql += (' AND (reporter = ? OR owner = ? OR id IN '
+                    '(SELECT ticket_id FROM ticket_change WHERE author = ?))')
+            params += [author] * 3
+        if since is not None:
+            sql += ' AND changetime >= ?'
+            params.append(_time(since))
+        if until is not None:
+            sql += ' AND changetime < ?'
+            params.append(_time(until))
+        return [row[0] for row in self._db.execute(sql + ' ORDER BY id', params)]
+
+    def ticket_get(self, ticket_id):
+        row = self._db.execute('SELECT attributes FROM ticket WHERE id = ?', (ticket_id,)).fetchone()
+        if row is None:
+            raise KeyError(ticket_id)
+        changelog = [
+            {'time': parse_datetime(time), 'author': author, 'field': field, 'oldvalue': oldvalue,
+             'newvalue': newvalue, 'permanent': bool(permanent)}
+            for time, author, field, oldvalue, newvalue, permanent in self._db.execute(
+                'SELECT time, author, field, oldvalue, newvalue, permanent FROM ticket_change '
+                'WHERE ticket_id = ? ORDER BY seq', (ticket_id,))
+        ]
+        return {
+            'attributes': _loads(row[0]),
+            'changelog': changelog,
+            'attachments': {
+                filename: {'attributes': attributes, 'data': data}
+                for filename, attributes, data in self._attachments('ticket', str(ticket_id))
+            },
+        }
+
+    def wiki_page_names(self):
+        return [row[0] for row in self._db.execute('SELECT name FROM wiki_page ORDER BY name')]
+
+    def wiki_page_get(self, name):
+        row = self._db.execute('SELECT text, attributes, history FROM wiki_page WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        page = {
+            'page': row[0],
+            'attributes': _loads(row[1]),
+            'attachments': {filename: data for filename, _, data in self._attachments('wiki', name)},
+        }
+        if row[2] is not None:
+            page['history'] = _loads(row[2])
+        return page
+
+    def milestones(self):
+        return {name: _loads(attributes)
+                for name, attributes in self._db.execute('SELECT name, attributes FROM milestone')}
+
+    def authors(self):
+        return [row[0] for row in self._db.execute('SELECT name FROM author ORDER BY name')]
+
+    def __iter__(self):
+        """Yield the archived project as ``(section, key, value)`` entries,
+        the same way trac.project_iter does"""
+        for name in self.wiki_page_names():
+            yield 'wiki', name, self.wiki_page_get(name)
+        for ticket_id in self.ticket_ids():
+            yield 'tickets', ticket_id, self.ticket_get(ticket_id)
+        for name, milestone in sorted(six.iteritems(self.milestones())):
+            yield 'milestones', name, milestone
+        yield 'authors', None, self.authors()
+
+
+def dump(entries, path):
+    """Write ``(section, key, value)`` entries to a new archive at ``path``"""
+    with Archive(path, create=True) as archive:
+        archive.write(entries)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import six
+
+
+LOG = logging.getLogger(__name__)
+
+
+class BlobStore(object):
+    """Content-addressed on-disk store for attachment payloads.
+
+    Blobs are keyed by the SHA-256 of their contents and laid out as
+    ``<root>/<digest[:2]>/<digest[2:]>``, so identical files are stored once.
+    Writes are atomic (temporary file + rename), the store can be shared
+    among crawler workers.
+    """
+
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def __contains__(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    def put(self, data):
+        """Store a bytes object, return its reference"""
+        return self.put_stream(six.BytesIO(data))
+
+    def put_stream(self, stream):
+        """Store the contents of a binary file object without loading it
+        as a whole, return its reference"""
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in iter(lambda: stream.read(self.CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+            digest = sha256.hexdigest()
+            if digest in self:
+                LOG.debug('blob %s already stored', digest)
+                os.remove(tmp_path)
+            else:
+                directory = os.path.dirname(self.path(digest))
+                if not os.path.isdir(directory):
+                    try:
+                        os.makedirs(directory)
+                    except OSError:
+                        # Created by a concurrent writer
+                        pass
+                shutil.move(tmp_path, self.path(digest))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return {'sha256': digest, 'size': size}
+
+    def open(self, ref):
+        return open(self.path(ref['sha256']), 'rb')
+
+    def get(self, ref):
+        with self.open(ref) as f:
+            return f.read()
+
+
+def is_ref(value):
+    return isinstance(value, dict) and 'sha256' in value
+
+
+def resolve(value, store=None):
+    """Return the payload of an exported attachment, reading it from
+    ``store`` if the export only holds its reference"""
+    if is_ref(value):
+        if store is None:
+            raise ValueError('attachment {} is stored out of band but no store has been given'.format(value['sha256']))
+        return store.get(value)
+    return value
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+import json
+import datetime
+import functools
+import pickle
+import sqlite3
+import logging
+import threading
+
+import six
+
+
+LOG = logging.getLogger(__name__)
+
+
+# Bumped whenever the schema changes, caches of older versions are discarded
+_SCHEMA_VERSION = 1
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS response (
+    method TEXT NOT NULL,
+    args TEXT NOT NULL,
+    validator TEXT NOT NULL,
+    value BLOB NOT NULL,
+    synced TEXT NOT NULL,
+    PRIMARY KEY (method, args)
+)
+'''
+
+# Allowance for the clock skew between this host and Trac
+SYNC_MARGIN = datetime.timedelta(minutes=10)
+
+# Cached methods along with the entity their validator comes from
+CACHED_METHODS = {
+    'ticket.get': 'ticket',
+    'ticket.changeLog': 'ticket',
+    'ticket.getAttachment': 'attachment',
+    'wiki.getPage': 'page',
+    # Older page versions never change
+    'wiki.getPageVersion': None,
+    'wiki.getPageInfoVersion': None,
+}
+
+
+class ResponseCache(object):
+    """Persistent cache of Trac responses keyed by method and arguments.
+
+    Every response is stored along with a validator of the entity it
+    belongs to and is only served while the validator still holds:
+
+    * ticket reads are validated by the ticket ``changetime``: every
+      cached ticket records when it was last known to be up to date, and
+      tickets changed since the oldest of these times
+      (``ticket.getRecentChanges``, asked once per crawl) are retrieved
+      again;
+    * wiki page reads are validated by the page ``version``, as reported
+      by ``wiki.getPageInfo`` during the crawl;
+    * ticket attachments are validated by their size and time, as
+      reported by ``ticket.listAttachments`` during the crawl.
+
+    Wiki attachments are not cached, replacing one does not bump the
+    version of its page. Anything whose validator is unknown is retrieved
+    from Trac. The cache
+    is shared among crawler workers, see CachedSource.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version != _SCHEMA_VERSION:
+            # Caches written before versioning have a response table but no version
+            existing = self._db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'response'").fetchone()
+            if version or existing:
+                LOG.info('discarding Trac response cache %s of an older version', path)
+                self._db.execute('DROP TABLE IF EXISTS response')
+            self._db.execute('PRAGMA user_version = {}'.format(_SCHEMA_VERSION))
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+        # Whatever is retrieved from now on is up to date as of this time
+        self._synced = (datetime.datetime.utcnow() - SYNC_MARGIN).strftime('%Y-%m-%dT%H:%M:%S')
+        self._changed_tickets = None
+        self._validators = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @property
+    def stats(self):
+        return 'hits={}, misses={}'.format(self.hits, self.misses)
+
+    @staticmethod
+    def _key(params):
+        return json.dumps(list(params))
+
+    def _get(self, method, params):
+        with self._lock:
+            return self._db.execute(
+                'SELECT validator, value FROM response WHERE method = ? AND args = ?',
+                (method, self._key(params))
+            ).fetchone()
+
+    def _put(self, method, params, validator, value):
+        data = sqlite3.Binary(pickle.dumps(value, protocol=2))
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO response (method, args, validator, value, synced) VALUES (?, ?, ?, ?, ?)',
+                (method, self._key(params), validator, data, self._synced)
+            )
+            self._db.commit()
+
+    def _touch(self, method, params):
+        """Record that a cached response is still up to date"""
+        with self._lock:
+            self._db.execute(
+                'UPDATE response SET synced = ? WHERE method = ? AND args = ?',
+                (self._synced, method, self._key(params))
+            )
+            self._db.commit()
+
+    def _ticket_changed(self, source, ticket_id):
+        """Whether a ticket changed since the oldest time a cached ticket
+        was known to be up to date"""
+        if self._changed_tickets is None:
+            with self._lock:
+                since = self._db.execute(
+                    "SELECT MIN(synced) FROM response WHERE method = 'ticket.get'"
+                ).fetchone()[0]
+            if since is None:
+                changed = set()
+            else:
+                since = datetime.datetime.strptime(since, '%Y-%m-%dT%H:%M:%S')
+                changed = set(source.ticket.getRecentChanges(since))
+                LOG.info('%s tickets changed since %s', len(changed), since)
+            self._changed_tickets = changed
+        return ticket_id in self._changed_tickets
+
+    @staticmethod
+    def _entity(method, params):
+        kind = CACHED_METHODS[method]
+        if kind == 'attachment':
+            return kind, 'ticket', tuple(params)
+        return kind, params[0] if params else None
+
+    def lookup(self, source, method, params):
+        """Return the cached response of a call still valid, raise KeyError
+        otherwise. ``source`` is only used to check for changed tickets."""
+        if method not in CACHED_METHODS:
+            raise KeyError(method)
+        entity = self._entity(method, params)
+        row = self._get(method, params)
+        if method == 'ticket.get':
+            # Its validator is the ticket changetime itself
+            if row is not None and self._ticket_changed(source, params[0]):
+                row = None
+            elif row is not None:
+                self._touch(method, params)
+            self._validators[entity] = row[0] if row is not None else None
+        if row is None or (CACHED_METHODS[method] is not None and row[0] != self._validators.get(entity)):
+            self.misses += 1
+            raise KeyError((method, params))
+        self.hits += 1
+        return pickle.loads(six.binary_type(row[1]))
+
+    def observe(self, method, params, value):
+        """Record the validators found in a response retrieved from Trac,
+        then cache it if it is cacheable and its validator is known"""
+        if method == 'ticket.get':
+            self._validators[('ticket', params[0])] = six.text_type(value[2])
+        elif method == 'wiki.getPageInfo':
+            self._validators[('page', params[0])] = six.text_type(value['version'])
+        elif method == 'ticket.listAttachments':
+            for meta in value:
+                self._validators[('attachment', 'ticket', (params[0], meta[0]))] = \
+                    six.text_type([meta[2], meta[3]])
+        if method not in CACHED_METHODS:
+            return
+        if CACHED_METHODS[method] is None:
+            validator = ''
+        else:
+            validator = self._validators.get(self._entity(method, params))
+        if validator is not None:
+            self._put(method, params, validator, value)
+
+
+class _Method(object):
+
+    def __init__(self, call, name):
+        self._call = call
+        self._name = name
+
+    def __getattr__(self, name):
+        return _Method(self._call, '{}.{}'.format(self._name, name))
+
+    def __call__(self, *params):
+        return self._call(self._name, params)
+
+
+class CachedSource(object):
+    """Drop-in replacement of a Trac source (ServerProxy) serving the calls
+    it can from a ResponseCache. Batches sent through ``system.multicall``
+    are split, only the calls missing from the cache reach Trac."""
+
+    def __init__(self, source, cache):
+        self._source = source
+        self._cache = cache
+
+    def __getattr__(self, name):
+        return _Method(self._call, name)
+
+    def _call(self, method, params):
+        if method == 'system.multicall':
+            return self._multicall(params[0])
+        try:
+            return self._cache.lookup(self._source, method, params)
+        except KeyError:
+            pass
+        value = functools.reduce(getattr, method.split('.'), self._source)(*params)
+        self._cache.observe(method, params, value)
+        return value
+
+    def _multicall(self, calls):
+        results = [None] * len(calls)
+        pending = []
+        for i, call in enumerate(calls):
+            try:
+                results[i] = [self._cache.lookup(self._source, call['methodName'], call['params'])]
+            except KeyError:
+                pending.append(i)
+        if pending:
+            LOG.debug('%s of %s multicall requests not cached', len(pending), len(calls))
+            fetched = self._source.system.multicall([calls[i] for i in pending])
+            for i, result in zip(pending, fetched):
+                results[i] = result
+                # Faults come as dicts, values wrapped in a single item list
+                if not isinstance(result, dict):
+                    self._cache.observe(calls[i]['methodName'], calls[i]['params'], result[0])
+        return results
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import binascii
+import datetime
+from xml.parsers import expat
+
+from six.moves import xmlrpc_client as xmlrpc
+
+
+def _datetime(text):
+    # Trac sends "YYYYMMDDTHH:MM:SS", anything else goes through strptime
+    if len(text) == 17 and text[8] == 'T':
+        try:
+            return datetime.datetime(int(text[0:4]), int(text[4:6]), int(text[6:8]),
+                                     int(text[9:11]), int(text[12:14]), int(text[15:17]))
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(text, '%Y%m%dT%H:%M:%S')
+
+
+def _boolean(text):
+    if text == '1':
+        return True
+    if text == '0':
+        return False
+    raise TypeError('bad boolean value')
+
+
+class FastUnmarshaller(object):
+    """Replacement of xmlrpc_client.Unmarshaller producing native types
+    directly: ``dateTime.iso8601`` values become naive datetimes and
+    ``base64`` ones bytes, instead of DateTime and Binary instances."""
+
+    _converters = {
+        'boolean': _boolean,
+        'i1': int,
+        'i2': int,
+        'i4': int,
+        'i8': int,
+        'int': int,
+        'biginteger': int,
+        'double': float,
+        'float': float,
+        'string': lambda text: text,
+        'name': lambda text: text,
+        'nil': lambda text: None,
+        'base64': lambda text: binascii.a2b_base64(text.encode('ascii')),
+        'dateTime.iso8601': _datetime,
+    }
+
+    def __init__(self):
+        self._stack = []
+        self._marks = []
+        self._data = []
+        self._value = False
+        self._type = None
+        self._methodname = None
+
+    def close(self):
+        if self._type is None or self._marks:
+            raise xmlrpc.ResponseError()
+        if self._type == 'fault':
+            raise xmlrpc.Fault(**self._stack[0])
+        return tuple(self._stack)
+
+    def getmethodname(self):
+        return self._methodname
+
+    def start(self, tag, attrs):
+        if tag == 'array' or tag == 'struct':
+            self._marks.append(len(self._stack))
+        self._data = []
+        self._value = tag == 'value'
+
+    def data(self, text):
+        self._data.append(text)
+
+    def end(self, tag):
+        text = ''.join(self._data)
+        if ':' in tag:
+            # e.g. Apache's ex:nil
+            tag = tag.rsplit(':', 1)[-1]
+        converter = self._converters.get(tag)
+        if converter is not None:
+            self._stack.append(converter(text))
+            self._value = False
+        elif tag == 'value':
+            # A value without type is a string
+            if self._value:
+                self._stack.append(text)
+        elif tag == 'array':
+            mark = self._marks.pop()
+            self._stack[mark:] = [self._stack[mark:]]
+            self._value = False
+        elif tag == 'struct':
+            mark = self._marks.pop()
+            items = self._stack[mark:]
+            self._stack[mark:] = [dict(zip(items[::2], items[1::2]))]
+            self._value = False
+        elif tag == 'params' or tag == 'fault':
+            self._type = tag
+        elif tag == 'methodName':
+            self._methodname = text
+
+
+class FastParser(object):
+    """Streaming expat parser feeding a FastUnmarshaller. Character data
+    is buffered by expat, so that large base64 payloads come in a few
+    chunks instead of one per line."""
+
+    BUFFER_SIZE = 1 << 16
+
+    def __init__(self, target):
+        self._parser = expat.ParserCreate(None, None)
+        self._parser.buffer_text = True
+        self._parser.buffer_size = self.BUFFER_SIZE
+        self._parser.StartElementHandler = target.start
+        self._parser.EndElementHandler = target.end
+        self._parser.CharacterDataHandler = target.data
+
+    def feed(self, data):
+        self._parser.Parse(data, False)
+
+    def close(self):
+        try:
+            self._parser.Parse(b'', True)
+        finally:
+            del self._parser
+
+
+def stock_getparser(use_datetime=True):
+    """``(parser, unmarshaller)`` pair of xmlrpc_client"""
+    return xmlrpc.getparser(use_datetime=use_datetime)
+
+
+def fast_getparser(use_datetime=True):
+    """``(parser, unmarshaller)`` pair of the fast decoder, which always
+    produces datetimes (``use_datetime`` is there for compatibility)"""
+    unmarshaller = FastUnmarshaller()
+    return FastParser(unmarshaller), unmarshaller
+
+
+DECODERS = {
+    'stock': stock_getparser,
+    'fast': fast_getparser,
+}
+
+
+def loads(data, getparser=fast_getparser, use_datetime=True):
+    """Same as xmlrpc_client.loads, with a pluggable decoder"""
+    parser, unmarshaller = getparser(use_datetime=use_datetime)
+    parser.feed(data)
+    parser.close()
+    return unmarshaller.close(), unmarshaller.getmethodname()
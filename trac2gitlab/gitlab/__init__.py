@@ -7,6 +7,7 @@ from collections import defaultdict
 import six
 
 from trac2gitlab import trac2down
+from trac2gitlab import blobstore
 
 LOG = logging.getLogger(__name__)
 
@@ -159,10 +160,19 @@ def milestone_kwargs(milestone):
 
 ################################################################################
 # Conversion API
+# Trac entities can be given either as a whole dict or as a stream of
+# (key, entity) pairs (e.g.: trac.ticket_iter(source)), the latter keeps
+# memory usage flat regardless of the project size.
 ################################################################################
 
+def _iteritems(entities):
+    if isinstance(entities, dict):
+        return six.iteritems(entities)
+    return iter(entities)
+
+
 def migrate_tickets(trac_tickets, gitlab, default_user, usermap=None):
-    for ticket_id, ticket in six.iteritems(trac_tickets):
+    for ticket_id, ticket in _iteritems(trac_tickets):
         issue_args = ticket_kwargs(ticket)
         # Fix references
         issue_args['project'] = gitlab.project_id()
@@ -187,7 +197,7 @@ def migrate_tickets(trac_tickets, gitlab, default_user, usermap=None):
 
 
 def migrate_milestones(trac_milestones, gitlab):
-    for title, milestone in six.iteritems(trac_milestones):
+    for title, milestone in _iteritems(trac_milestones):
         gitlab_milestone = gitlab.model.Milestones(
             project=gitlab.project_id(),
             **milestone_kwargs(milestone)
@@ -196,8 +206,8 @@ def migrate_milestones(trac_milestones, gitlab):
         LOG.debug('migrated milestone %s -> %s', title, db_milestone.iid)
 
 
-def migrate_wiki(trac_wiki, gitlab, output_dir):
-    for title, wiki in six.iteritems(trac_wiki):
+def migrate_wiki(trac_wiki, gitlab, output_dir, store=None):
+    for title, wiki in _iteritems(trac_wiki):
         page = wiki['page']
         attachments = wiki['attachments']
         author = wiki['attributes']['author']
@@ -208,7 +218,8 @@ def migrate_wiki(trac_wiki, gitlab, output_dir):
         converted_page = trac2down.convert(page, os.path.dirname('/wikis/%s' % title))
         orphaned = []
         for filename, attachment in six.iteritems(attachments):
-            data = attachment['data']
+            # Read lazily from the blob store, if exported out of band
+            data = blobstore.resolve(attachment, store)
             name = filename.split('/')[-1]
             gitlab.save_wiki_attachment(name, data)
             converted_page = \
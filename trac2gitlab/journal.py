@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pickle
+import sqlite3
+import logging
+import threading
+
+import six
+
+
+LOG = logging.getLogger(__name__)
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS journal (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (kind, key)
+)
+'''
+
+
+class Journal(object):
+    """On-disk checkpoint journal of a crawl.
+
+    Every finished entity (ticket, wiki page, attachment, milestone...) is
+    recorded under a ``(kind, key)`` pair and committed right away, so an
+    interrupted crawl can be resumed skipping the work already done.
+    The journal is shared among crawler workers.
+    """
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(_SCHEMA)
+        if not resume:
+            LOG.debug('discarding previous checkpoints in %s', path)
+            self._db.execute('DELETE FROM journal')
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(key)
+
+    def get(self, kind, key):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value FROM journal WHERE kind = ? AND key = ?',
+                (kind, self._key(key))
+            ).fetchone()
+        if row is None:
+            raise KeyError((kind, key))
+        return pickle.loads(six.binary_type(row[0]))
+
+    def get_many(self, kind, keys):
+        """Return a dict of the recorded values among ``keys``"""
+        found = {}
+        for key in keys:
+            try:
+                found[key] = self.get(kind, key)
+            except KeyError:
+                pass
+        return found
+
+    def put(self, kind, key, value):
+        data = sqlite3.Binary(pickle.dumps(value, protocol=2))
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO journal (kind, key, value) VALUES (?, ?, ?)',
+                (kind, self._key(key), data)
+            )
+            self._db.commit()
+
+
+def journaled(journal, kind, func):
+    """Wrap ``func(source, key)`` so that its results are read from (when
+    already recorded) and recorded to ``journal``"""
+    if journal is None:
+        return func
+
+    @six.wraps(func)
+    def wrapper(source, key):
+        try:
+            return journal.get(kind, key)
+        except KeyError:
+            pass
+        value = func(source, key)
+        journal.put(kind, key, value)
+        return value
+    return wrapper
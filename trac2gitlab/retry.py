@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+import time
+import random
+import socket
+import logging
+import threading
+import contextlib
+from collections import deque
+
+import six
+from six.moves import http_client
+from six.moves import xmlrpc_client as xmlrpc
+
+
+LOG = logging.getLogger(__name__)
+
+
+TRANSIENT_HTTP_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+
+_expected = threading.local()
+
+
+@contextlib.contextmanager
+def faults_expected(match=None):
+    """Within this block, XML-RPC Faults of the calls made by the current
+    thread (only the ones ``match(fault)`` is true for, if given) are
+    expected by the caller, e.g. the end of a paginated query: they are
+    raised right away, neither retried nor logged"""
+    previous = getattr(_expected, 'match', None)
+    _expected.match = match if match is not None else (lambda fault: True)
+    try:
+        yield
+    finally:
+        _expected.match = previous
+
+
+def _is_expected(fault):
+    match = getattr(_expected, 'match', None)
+    return match is not None and match(fault)
+
+
+def is_transient(error):
+    """Whether a failed XML-RPC call is worth retrying (Faults aside)"""
+    if isinstance(error, xmlrpc.ProtocolError):
+        return error.errcode in TRANSIENT_HTTP_STATUSES
+    return isinstance(error, (socket.error, http_client.HTTPException))
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter: the n-th retry waits a random
+    time between 0 and ``min(max_delay, base_delay * 2 ** n)`` seconds"""
+
+    def __init__(self, retries=5, base_delay=0.5, max_delay=30.0):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, retry):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+
+class CircuitBreaker(object):
+    """Shared among all the crawler workers, trips when at least
+    ``threshold`` of the last ``window`` calls failed: every worker is then
+    paused for ``cooldown`` seconds before hitting Trac again."""
+
+    def __init__(self, window=20, threshold=0.5, cooldown=30.0):
+        self.window = window
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._results = deque(maxlen=window)
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                remaining = self._open_until - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def record(self, success):
+        """Record the outcome of a call, return True if the breaker trips"""
+        with self._lock:
+            self._results.append(success)
+            if len(self._results) < self.window:
+                return False
+            failures = self._results.count(False)
+            if failures < self.threshold * self.window:
+                return False
+            self._results.clear()
+            self._open_until = time.time() + self.cooldown
+        LOG.warning('%s of the last %s Trac calls failed, pausing all workers for %ss',
+                    failures, self.window, self.cooldown)
+        return True
+
+
+class RetryStats(object):
+
+    FIELDS = (
+        'calls',
+        'retries',
+        'fault_retries',
+        'give_ups',
+        'breaker_trips',
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in six.iteritems(counters):
+                self._counters[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def __str__(self):
+        counters = self.snapshot()
+        return ', '.join('{}={}'.format(name, counters[name]) for name in self.FIELDS)
+
+
+class Retrier(object):
+    """Run calls retrying transient errors according to ``policy`` and
+    XML-RPC Faults according to ``fault_policy`` (Faults are usually
+    deterministic, e.g. a missing ticket, so they get fewer retries and
+    do not count as failures for the circuit breaker, see also
+    faults_expected)."""
+
+    def __init__(self, policy=None, fault_policy=None, breaker=None):
+        self.policy = policy if policy is not None else RetryPolicy()
+        self.fault_policy = fault_policy if fault_policy is not None else RetryPolicy(retries=1)
+        self.breaker = breaker
+        self.stats = RetryStats()
+
+    def _record(self, success):
+        if self.breaker is not None and self.breaker.record(success):
+            self.stats.add(breaker_trips=1)
+
+    def call(self, func, *args, **kwargs):
+        self.stats.add(calls=1)
+        retries = {'retries': 0, 'fault_retries': 0}
+        while True:
+            if self.breaker is not None:
+                self.breaker.wait()
+            try:
+                result = func(*args, **kwargs)
+            except xmlrpc.Fault as e:
+                # Trac answered, there is nothing wrong with the connection
+                if _is_expected(e):
+                    raise
+                counter, policy = 'fault_retries', self.fault_policy
+                error = e
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                self._record(False)
+                counter, policy = 'retries', self.policy
+                error = e
+            else:
+                self._record(True)
+                return result
+            if retries[counter] >= policy.retries:
+                self.stats.add(give_ups=1)
+                LOG.error('giving up after %s retries: %s', retries[counter], error)
+                raise error
+            delay = policy.delay(retries[counter])
+            retries[counter] += 1
+            self.stats.add(**{counter: 1})
+            LOG.warning('%s, retry %s/%s in %.2fs', error, retries[counter], policy.retries, delay)
+            time.sleep(delay)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import binascii
+import datetime
+
+import six
+
+
+# Fields holding datetimes in exported entities
+DATETIME_FIELDS = frozenset(['time', 'changetime', 'lastModified', 'due', 'completed'])
+
+DATETIME_FORMATS = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f']
+
+
+def json_default(obj):
+    """Encode the values json does not know about: datetimes as ISO 8601
+    text, bytes (attachment payloads) as base64"""
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    elif isinstance(obj, six.binary_type):
+        return base64.b64encode(obj).decode('ascii')
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
+
+
+def parse_datetime(value):
+    """Inverse of json_default for datetimes, other values are returned as is"""
+    if not isinstance(value, six.string_types):
+        return value
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_data(value):
+    """Inverse of json_default for attachment payloads, other values (e.g.
+    blob store references) are returned as is"""
+    if not isinstance(value, six.string_types):
+        return value
+    try:
+        return base64.b64decode(value.encode('ascii'))
+    except (binascii.Error, TypeError, UnicodeEncodeError):
+        return value
+
+
+def json_object_hook(obj):
+    """Inverse of json_default for exported entities, to be used as the
+    ``object_hook`` of json decoders: datetime fields and attachment
+    payloads get back the types a crawl gives them"""
+    for key, value in six.iteritems(obj):
+        if key in DATETIME_FIELDS:
+            obj[key] = parse_datetime(value)
+        elif key == 'data':
+            # Ticket attachment
+            obj[key] = parse_data(value)
+    attachments = obj.get('attachments')
+    if 'page' in obj and isinstance(attachments, dict):
+        # Wiki attachments are bare payloads
+        obj['attachments'] = {filename: parse_data(data) for filename, data in six.iteritems(attachments)}
+    return obj
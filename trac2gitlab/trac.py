@@ -1,43 +1,265 @@
 # -*- coding: utf-8 -*-
 
 import ssl
+import zlib
+import time
+import difflib
 import logging
+import functools
+import itertools
+import threading
+import collections
+from concurrent import futures
 
 import six
+from six.moves import queue
 from six.moves import xmlrpc_client as xmlrpc
 
+from .cache import CachedSource
+from .journal import journaled
+from .retry import faults_expected
+from .transport import make_transport
+
 
 LOG = logging.getLogger(__name__)
 
 
+# Values of ticket enumerations (milestones, components...) per multicall
+ENUM_BATCH_SIZE = 500
+
+
 def _safe_retrieve_data(data, encoding='base64'):
     try:
         # six.b(data.decode(encoding))
-        return six.b(data)
+        return data if isinstance(data, six.binary_type) else six.b(data)
     except Exception as e:
         LOG.exception('error while decoding data from %s', encoding)
         return str(e)
 
 
+def _store_data(data, store=None):
+    """Exported value of an attachment payload: the bytes themselves or their reference in ``store``"""
+    if isinstance(data, xmlrpc.Binary):
+        data = data.data
+    data = _safe_retrieve_data(data)
+    if store is None or not isinstance(data, six.binary_type):
+        return data
+    return store.put(data)
+
+
+def _read_attachment_file(files, realm, parent_id, filename, store=None):
+    """Attachment read from the Trac environment ``files``, None to fall back to XML-RPC"""
+    if files is None:
+        return None
+    try:
+        return files.read(realm, parent_id, filename, store=store)
+    except (IOError, OSError) as e:
+        LOG.warning('%s, falling back to XML-RPC', e)
+        return None
+
+
+def _read_wiki_attachment_file(files, filename, store=None):
+    # Wiki attachments are listed as "<pagename>/<filename>"
+    pagename, _, basename = filename.rpartition('/')
+    return _read_attachment_file(files, 'wiki', pagename, basename, store=store)
+
+
+def _ticket_authors(ticket):
+    yield ticket['attributes']['reporter']
+    yield ticket['attributes']['owner']
+    for change in ticket['changelog']:
+        yield change['author']
+
+
 def _authors_collect(wiki=None, tickets=None):
-    wiki = wiki or []
-    tickets = tickets or []
-    return list(set(
-        [page['attributes']['author'] for page in six.itervalues(wiki)] + \
-        [ticket['attributes']['reporter'] for ticket in six.itervalues(tickets)] + \
-        [ticket['attributes']['owner'] for ticket in six.itervalues(tickets)] + \
-        [change['author'] for ticket in six.itervalues(tickets) for change in ticket['changelog']]
-    ))
+    wiki = wiki or {}
+    tickets = tickets or {}
+    authors = set(page['attributes']['author'] for page in six.itervalues(wiki))
+    for ticket in six.itervalues(tickets):
+        authors.update(_ticket_authors(ticket))
+    return sorted(authors)
 
 
-def ticket_get_attributes(source, ticket_id):
-    LOG.debug('ticket_get_attributes of ticket #%s', ticket_id)
-    ticket = source.ticket.get(ticket_id)
-    return ticket[3]
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 
-def ticket_get_changelog(source, ticket_id):
-    LOG.debug('ticket_get_changelog of ticket #%s', ticket_id)
+def _percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class AdaptiveLimit(object):
+    """AIMD concurrency limit of the crawler workers, driven by the latency of Trac calls"""
+
+    LOG_INTERVAL = 30.0
+    MIN_ROUND = 10
+
+    def __init__(self, max_limit, min_limit=1, initial=1, tolerance=2.0, backoff=0.5, drift=0.01, window=200):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.drift = drift
+        self._limit = float(max(min_limit, min(initial, max_limit)))
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._latencies = collections.deque(maxlen=window)
+        self._round = []
+        self._errors = 0
+        self._settling = 0
+        self._baseline = None
+        self._logged = time.time()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def percentiles(self):
+        with self._condition:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return {}
+        return {p: _percentile(latencies, p / 100.0) for p in (50, 90, 99)}
+
+    def observe(self, latency, success=True):
+        with self._condition:
+            self._latencies.append(latency)
+            self._round.append(latency)
+            if not success:
+                self._errors += 1
+            if self._settling:
+                # Calls started before the last back off do not tell anything about the new limit
+                self._settling -= 1
+                self._round, self._errors = [], 0
+                return
+            if len(self._round) < max(self.limit, self.MIN_ROUND):
+                return
+            latencies, errors = sorted(self._round), self._errors
+            self._round, self._errors = [], 0
+            median = _percentile(latencies, 0.5)
+            if self._baseline is None:
+                self._baseline = median
+            else:
+                self._baseline = min(median, self._baseline * (1 + self.drift))
+            previous = self.limit
+            if errors or _percentile(latencies, 0.9) > self.tolerance * self._baseline:
+                self._limit = max(self.min_limit, self._limit * self.backoff)
+                self._settling = previous
+            else:
+                self._limit = min(self.max_limit, self._limit + 1)
+            self._condition.notify_all()
+            limit = self.limit
+            periodic = time.time() - self._logged >= self.LOG_INTERVAL
+            if periodic or limit < previous:
+                self._logged = time.time()
+        if limit < previous:
+            LOG.info('backing off, concurrency limit %s -> %s (%s errors, latency baseline %.0fms): %s',
+                     previous, limit, errors, self._baseline * 1000, self)
+        elif limit > previous:
+            LOG.debug('concurrency limit %s -> %s', previous, limit)
+        if periodic:
+            LOG.info('%s', self)
+
+    def __str__(self):
+        percentiles = self.percentiles()
+        return 'limit={}, {}'.format(self.limit, ', '.join(
+            'p{}={:.0f}ms'.format(p, percentiles[p] * 1000) for p in sorted(percentiles)
+        ) or 'no calls')
+
+
+class Pool(object):
+    """Bounded pool of crawler workers, each with its own source built through ``factory``"""
+
+    def __init__(self, factory, workers, limit=None):
+        self.factory = factory
+        self.workers = workers
+        self.limit = limit
+        self._local = threading.local()
+        self._executor = futures.ThreadPoolExecutor(max_workers=workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def source(self):
+        source = getattr(self._local, 'source', None)
+        if source is None:
+            LOG.debug('building source for worker %s', threading.current_thread().name)
+            source = self._local.source = self.factory()
+        return source
+
+    def _run(self, func, item):
+        if self.limit is None:
+            return func(self.source(), item)
+        self.limit.acquire()
+        try:
+            return func(self.source(), item)
+        finally:
+            self.limit.release()
+
+    def imap(self, func, items):
+        """Lazy version of ``map``, results come in input order"""
+        window = collections.deque()
+        for item in items:
+            window.append(self._executor.submit(self._run, func, item))
+            if len(window) >= 2 * self.workers:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+def _imap(source, pool, func, items):
+    if pool is None:
+        return (func(source, item) for item in items)
+    return pool.imap(func, items)
+
+
+def _multicall_params(calls):
+    return [{'methodName': method, 'params': list(args)} for method, args in calls]
+
+
+def _multicall_values(results, faults=False):
+    """Values of the calls of a ``system.multicall``, see _multicall"""
+    values = []
+    for result in results:
+        if isinstance(result, dict):
+            fault = xmlrpc.Fault(result['faultCode'], result['faultString'])
+            if not faults:
+                raise fault
+            values.append(fault)
+        else:
+            values.append(result[0])
+    return values
+
+
+def _multicall(source, calls, faults=False):
+    """Pack ``(method, args)`` calls into a single ``system.multicall``"""
+    return _multicall_values(source.system.multicall(_multicall_params(calls)), faults=faults)
+
+
+def _changelog_from_raw(changelog):
     return [
         {
             'time': c[0],
@@ -47,45 +269,434 @@ def ticket_get_changelog(source, ticket_id):
             'newvalue': c[4],
             'permanent': bool(c[5])
         }
-        for c in source.ticket.changeLog(ticket_id)
+        for c in changelog
     ]
 
 
-def ticket_get_attachments(source, ticket_id):
+def _attachment_attributes_from_raw(meta):
+    return {
+        'filename': meta[0],
+        'description': meta[1],
+        'size': meta[2],
+        'time': meta[3],
+        'author': meta[4],
+    }
+
+
+def ticket_get_attributes(source, ticket_id):
+    LOG.debug('ticket_get_attributes of ticket #%s', ticket_id)
+    ticket = source.ticket.get(ticket_id)
+    return ticket[3]
+
+
+def ticket_get_changelog(source, ticket_id):
+    LOG.debug('ticket_get_changelog of ticket #%s', ticket_id)
+    return _changelog_from_raw(source.ticket.changeLog(ticket_id))
+
+
+def _ticket_get_attachment_data(source, key, store=None, files=None):
+    ticket_id, filename = key
+    data = _read_attachment_file(files, 'ticket', ticket_id, filename, store=store)
+    if data is not None:
+        return data
+    return _store_data(source.ticket.getAttachment(ticket_id, filename), store)
+
+
+def ticket_get_attachments(source, ticket_id, journal=None, store=None, files=None, download=True):
+    """Attachments of a ticket, their data is left to None unless ``download`` is set"""
     LOG.debug('ticket_get_attachments of ticket #%s', ticket_id)
+    get_data = journaled(journal, 'ticket-attachment',
+                         functools.partial(_ticket_get_attachment_data, store=store, files=files))
     return {
         meta[0]: {
-            'attributes': {
-                'filename': meta[0],
-                'description': meta[1],
-                'size': meta[2],
-                'time': meta[3],
-                'author': meta[4],
-            },
-            'data': _safe_retrieve_data(source.ticket.getAttachment(ticket_id, meta[0]).data)
+            'attributes': _attachment_attributes_from_raw(meta),
+            'data': get_data(source, [ticket_id, meta[0]]) if download else None,
         }
         for meta in source.ticket.listAttachments(ticket_id)
     }
 
 
-def ticket_get_all(source, attachments=True):
-    LOG.debug('ticket_get_all')
+def ticket_get(source, ticket_id, attachments=True, journal=None, store=None, files=None, download=True):
     return {
-        ticket_id: {
-            'attributes': ticket_get_attributes(source, ticket_id),
-            'changelog': ticket_get_changelog(source, ticket_id),
-            'attachments': ticket_get_attachments(source, ticket_id) if attachments else {},
-        }
-        for ticket_id in source.ticket.query("max=0&order=id")
+        'attributes': ticket_get_attributes(source, ticket_id),
+        'changelog': ticket_get_changelog(source, ticket_id),
+        'attachments': ticket_get_attachments(source, ticket_id, journal=journal, store=store, files=files,
+                                              download=download)
+            if attachments else {},
     }
 
 
-def milestone_get_all(source):
+def _ticket_batch_calls(ticket_ids, attachments=True):
+    calls = []
+    for ticket_id in ticket_ids:
+        calls.append(('ticket.get', (ticket_id,)))
+        calls.append(('ticket.changeLog', (ticket_id,)))
+        if attachments:
+            calls.append(('ticket.listAttachments', (ticket_id,)))
+    return calls
+
+
+def _ticket_batch_from_results(ticket_ids, results, attachments=True):
+    """Tickets out of the results of _ticket_batch_calls, without attachment data"""
+    results = iter(results)
+    tickets = {}
+    for ticket_id in ticket_ids:
+        tickets[ticket_id] = {
+            'attributes': next(results)[3],
+            'changelog': _changelog_from_raw(next(results)),
+            'attachments': {
+                meta[0]: {
+                    'attributes': _attachment_attributes_from_raw(meta),
+                    'data': None,
+                }
+                for meta in next(results)
+            } if attachments else {},
+        }
+    return tickets
+
+
+def _ticket_batch_pending(tickets, store=None, files=None):
+    """Read the attachments of a batch from ``files``, return the keys of the missing ones"""
+    pending = []
+    for ticket_id, ticket in sorted(six.iteritems(tickets)):
+        for filename, attachment in six.iteritems(ticket['attachments']):
+            attachment['data'] = _read_attachment_file(files, 'ticket', ticket_id, filename, store=store)
+            if attachment['data'] is None:
+                pending.append((ticket_id, filename))
+    return pending
+
+
+def _ticket_batch_data_calls(pending):
+    return [('ticket.getAttachment', key) for key in pending]
+
+
+def _ticket_batch_store(tickets, pending, data, store=None):
+    for (ticket_id, filename), binary in zip(pending, data):
+        tickets[ticket_id]['attachments'][filename]['data'] = _store_data(binary, store)
+
+
+def ticket_get_batch(source, ticket_ids, attachments=True, store=None, files=None, download=True):
+    """Retrieve a batch of tickets in (at most) two ``system.multicall`` round trips"""
+    LOG.debug('ticket_get_batch of tickets %s', ticket_ids)
+    tickets = _ticket_batch_from_results(
+        ticket_ids, _multicall(source, _ticket_batch_calls(ticket_ids, attachments)), attachments)
+    if attachments and download:
+        pending = _ticket_batch_pending(tickets, store=store, files=files)
+        if pending:
+            _ticket_batch_store(tickets, pending, _multicall(source, _ticket_batch_data_calls(pending)), store)
+    return tickets
+
+
+def _query_value(value):
+    """Escape a value of a Trac query string"""
+    return six.text_type(value).replace('\\', '\\\\').replace('&', '\\&').replace('|', '\\|')
+
+
+def _query_time(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ') if value is not None else ''
+
+
+def ticket_query(ids=None, components=None, milestones=None, statuses=None, created=None, changed=None):
+    """Trac query string selecting tickets, so that Trac does the filtering"""
+    clauses = []
+    if ids:
+        clauses.append('id=' + '|'.join(
+            '{}-{}'.format(*i) if isinstance(i, tuple) else six.text_type(i) for i in ids
+        ))
+    for field, values in (('component', components), ('milestone', milestones), ('status', statuses)):
+        if values:
+            clauses.append('{}={}'.format(field, '|'.join(_query_value(value) for value in values)))
+    for field, (since, until) in (('time', created or (None, None)), ('changetime', changed or (None, None))):
+        if since is not None or until is not None:
+            clauses.append('{}={}..{}'.format(field, _query_time(since), _query_time(until)))
+    return '&'.join(clauses)
+
+
+def _ids_query(query, options):
+    return '{}&{}'.format(query, options) if query else options
+
+
+def ticket_get_all_ids(source, query=None):
+    """Ids of all the tickets (only the ones matching ``query``, if given)"""
+    LOG.debug('ticket_get_all_ids')
+    return list(source.ticket.query(_ids_query(query, 'max=0&order=id')))
+
+
+def is_past_last_page(fault, page):
+    """Whether a ticket.query Fault is Trac refusing a page beyond the last one"""
+    return page > 1 and 'is beyond the number of pages' in fault.faultString
+
+
+def ticket_get_ids_page(source, page, page_size, query=None):
+    """Ticket ids of the ``page``-th page (from 1) in id order, empty past the last page"""
+    LOG.debug('ticket_get_ids_page %s (%s tickets per page)', page, page_size)
+    try:
+        with faults_expected(lambda fault: is_past_last_page(fault, page)):
+            return list(source.ticket.query(
+                _ids_query(query, 'max={}&page={}&order=id'.format(page_size, page))
+            ))
+    except xmlrpc.Fault as e:
+        if not is_past_last_page(e, page):
+            raise
+        LOG.debug('ticket_get_ids_page %s: %s', page, e.faultString)
+        return []
+
+
+def ticket_iter_ids(source, page_size=None, query=None):
+    """Yield all ticket ids in id order, ``page_size`` at a time if given"""
+    LOG.debug('ticket_iter_ids')
+    if not page_size:
+        for ticket_id in ticket_get_all_ids(source, query=query):
+            yield ticket_id
+        return
+    page = 1
+    while True:
+        ticket_ids = ticket_get_ids_page(source, page, page_size, query=query)
+        for ticket_id in ticket_ids:
+            yield ticket_id
+        if len(ticket_ids) < page_size:
+            return
+        page += 1
+
+
+class AttachmentLane(object):
+    """Download lane for ticket attachments, separate from the crawl of ticket metadata"""
+
+    def __init__(self, factory, workers=2, max_size=None, skip_oversized=False, journal=None, store=None,
+                 files=None, max_pending=100):
+        self.factory = factory
+        self.max_size = max_size
+        self.max_pending = max_pending
+        self.skip_oversized = skip_oversized
+        self.report = []
+        self._get_data = journaled(journal, 'ticket-attachment',
+                                   functools.partial(_ticket_get_attachment_data, store=store, files=files))
+        self._queue = queue.PriorityQueue()
+        self._done = queue.Queue()
+        self._sequence = itertools.count()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name='attachment-lane-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # Do not wait for the queued downloads when the crawl failed
+        self.close(cancel=exc_info[0] is not None)
+
+    def close(self, cancel=False):
+        """Stop the download threads once the queued downloads (only the ongoing ones if ``cancel``) are done"""
+        for _ in self._threads:
+            # Sentinels sort before any download when cancelling, after otherwise
+            self._queue.put((-1 if cancel else 2, 0, next(self._sequence), None, None))
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self):
+        source = self.factory()
+        while True:
+            _, _, _, state, filename = self._queue.get()
+            if state is None:
+                return
+            try:
+                if state['error'] is None:
+                    state['ticket']['attachments'][filename]['data'] = \
+                        self._get_data(source, [state['ticket_id'], filename])
+            except Exception as e:
+                LOG.exception('error while downloading attachment %s of ticket #%s', filename, state['ticket_id'])
+                state['error'] = e
+            with self._lock:
+                state['left'] -= 1
+                done = state['left'] == 0
+            if done:
+                self._done.put(state)
+
+    def schedule(self, ticket_id, ticket):
+        """Queue the attachment downloads of a ticket, False if there is nothing to download"""
+        jobs = []
+        for filename, attachment in six.iteritems(ticket['attachments']):
+            size = attachment['attributes']['size']
+            oversized = self.max_size is not None and size > self.max_size
+            if oversized:
+                action = 'skipped' if self.skip_oversized else 'deferred'
+                LOG.warning('attachment %s of ticket #%s is %s bytes large, %s', filename, ticket_id, size, action)
+                self.report.append({'ticket': ticket_id, 'filename': filename, 'size': size, 'action': action})
+                if self.skip_oversized:
+                    continue
+            jobs.append((int(oversized), size, filename))
+        if not jobs:
+            return False
+        state = {'ticket_id': ticket_id, 'ticket': ticket, 'left': len(jobs), 'error': None}
+        self._pending += 1
+        for priority, size, filename in jobs:
+            self._queue.put((priority, size, next(self._sequence), state, filename))
+        return True
+
+    def _completed(self, block):
+        while self._pending:
+            try:
+                state = self._done.get(block=block or self._pending >= self.max_pending)
+            except queue.Empty:
+                return
+            self._pending -= 1
+            if state['error'] is not None:
+                raise state['error']
+            yield state['ticket_id'], state['ticket']
+
+    def completed(self):
+        """Yield the tickets completed so far, waiting while ``max_pending`` or more are queued"""
+        return self._completed(block=False)
+
+    def drain(self):
+        """Yield the remaining ``(ticket_id, ticket)`` pairs as they complete"""
+        return self._completed(block=True)
+
+
+def _ticket_iter_lane(source, ticket_ids, lane, batch_size=None, pool=None, journal=None, store=None, files=None):
+    def crawl(s, ids):
+        batch = journal.get_many('ticket', ids) if journal is not None else {}
+        missing = [ticket_id for ticket_id in ids if ticket_id not in batch]
+        if batch_size:
+            fetched = ticket_get_batch(s, missing, store=store, files=files, download=False) if missing else {}
+        else:
+            fetched = {
+                ticket_id: ticket_get(s, ticket_id, journal=journal, store=store, files=files, download=False)
+                for ticket_id in missing
+            }
+        return [
+            (ticket_id, batch[ticket_id], True) if ticket_id in batch else (ticket_id, fetched[ticket_id], False)
+            for ticket_id in ids
+        ]
+
+    def complete(ticket_id, ticket):
+        if journal is not None:
+            journal.put('ticket', ticket_id, ticket)
+        return ticket_id, ticket
+
+    for batch in _imap(source, pool, crawl, _chunks(ticket_ids, batch_size or 1)):
+        for ticket_id, ticket, journaled_ticket in batch:
+            if journaled_ticket:
+                yield ticket_id, ticket
+            elif not lane.schedule(ticket_id, ticket):
+                yield complete(ticket_id, ticket)
+        for ticket_id, ticket in lane.completed():
+            yield complete(ticket_id, ticket)
+    for ticket_id, ticket in lane.drain():
+        yield complete(ticket_id, ticket)
+
+
+def ticket_iter(source, ticket_ids=None, attachments=True, batch_size=None, pool=None, journal=None, store=None,
+                files=None, lane=None, page_size=None, query=None):
+    """Yield ``(ticket_id, ticket)`` pairs one at a time"""
+    LOG.debug('ticket_iter')
+    if ticket_ids is None:
+        ticket_ids = ticket_iter_ids(source, page_size=page_size, query=query)
+    if lane is not None and attachments:
+        for item in _ticket_iter_lane(source, ticket_ids, lane, batch_size=batch_size, pool=pool, journal=journal,
+                                      store=store, files=files):
+            yield item
+        return
+    if batch_size:
+        def crawl(s, ids):
+            batch = journal.get_many('ticket', ids) if journal is not None else {}
+            missing = [ticket_id for ticket_id in ids if ticket_id not in batch]
+            if missing:
+                fetched = ticket_get_batch(s, missing, attachments=attachments, store=store, files=files)
+                if journal is not None:
+                    for ticket_id, ticket in six.iteritems(fetched):
+                        journal.put('ticket', ticket_id, ticket)
+                batch.update(fetched)
+            return [(ticket_id, batch[ticket_id]) for ticket_id in ids]
+
+        for batch in _imap(source, pool, crawl, _chunks(ticket_ids, batch_size)):
+            for item in batch:
+                yield item
+        return
+    get = journaled(journal, 'ticket',
+                    lambda s, ticket_id: ticket_get(s, ticket_id, attachments=attachments,
+                                                    journal=journal, store=store, files=files))
+    for item in _imap(source, pool, lambda s, ticket_id: (ticket_id, get(s, ticket_id)), ticket_ids):
+        yield item
+
+
+def ticket_get_all(source, attachments=True, batch_size=None, pool=None, journal=None, store=None, files=None,
+                   lane=None, page_size=None, query=None):
+    LOG.debug('ticket_get_all')
+    return dict(ticket_iter(source, attachments=attachments, batch_size=batch_size, pool=pool,
+                            journal=journal, store=store, files=files, lane=lane, page_size=page_size,
+                            query=query))
+
+
+def ticket_get_many(source, ticket_ids, attachments=True, batch_size=None, pool=None, journal=None, store=None,
+                    files=None, lane=None):
+    LOG.debug('ticket_get_many of %s tickets', len(ticket_ids))
+    return dict(ticket_iter(source, ticket_ids, attachments=attachments, batch_size=batch_size,
+                            pool=pool, journal=journal, store=store, files=files, lane=lane))
+
+
+def _enum_batch_size(batch_size):
+    """Enumeration values are small, they go in larger batches than tickets"""
+    return max(batch_size, ENUM_BATCH_SIZE) if batch_size else None
+
+
+def ticket_enum_get_all_names(source, realm):
+    LOG.debug('ticket_enum_get_all_names of %s', realm)
+    return list(getattr(source.ticket, realm).getAll())
+
+
+def ticket_enum_get(source, realm, name):
+    LOG.debug('ticket_enum_get of %s %s', realm, name)
+    return getattr(source.ticket, realm).get(name)
+
+
+def ticket_enum_get_batch(source, realm, names):
+    """Retrieve many values of a ticket enumeration in a single ``system.multicall``"""
+    LOG.debug('ticket_enum_get_batch of %s %s', realm, names)
+    return _multicall(source, [('ticket.{}.get'.format(realm), (name,)) for name in names])
+
+
+def ticket_enum_iter(source, realm, batch_size=None, pool=None, journal=None):
+    """Yield ``(name, value)`` pairs of a ticket enumeration (``milestone``, ``component``...)"""
+    LOG.debug('ticket_enum_iter of %s', realm)
+    names = ticket_enum_get_all_names(source, realm)
+    if batch_size:
+        def crawl(s, chunk):
+            values = journal.get_many(realm, chunk) if journal is not None else {}
+            missing = [name for name in chunk if name not in values]
+            if missing:
+                for name, value in zip(missing, ticket_enum_get_batch(s, realm, missing)):
+                    if journal is not None:
+                        journal.put(realm, name, value)
+                    values[name] = value
+            return [(name, values[name]) for name in chunk]
+
+        for chunk in _imap(source, pool, crawl, _chunks(names, batch_size)):
+            for item in chunk:
+                yield item
+        return
+    get = journaled(journal, realm, lambda s, name: ticket_enum_get(s, realm, name))
+    for item in zip(names, _imap(source, pool, get, names)):
+        yield item
+
+
+def ticket_enum_get_all(source, realm, batch_size=None, pool=None, journal=None):
+    return dict(ticket_enum_iter(source, realm, batch_size=batch_size, pool=pool, journal=journal))
+
+
+def milestone_iter(source, batch_size=None, pool=None, journal=None):
+    LOG.debug('milestone_iter')
+    return ticket_enum_iter(source, 'milestone', batch_size=batch_size, pool=pool, journal=journal)
+
+
+def milestone_get_all(source, batch_size=None, pool=None, journal=None):
     LOG.debug('milestone_get_all')
-    return {
-        milestone: source.ticket.milestone.get(milestone)
-            for milestone in milestone_get_all_names(source)
-    }
+    return dict(milestone_iter(source, batch_size=batch_size, pool=pool, journal=journal))
 
 
 def milestone_get(source, milestone_name):
@@ -98,60 +709,353 @@ def milestone_get_all_names(source):
     return list(source.ticket.milestone.getAll())
 
 
-def wiki_get_all_pages(source, authors_blacklist=None, contents=True, attachments=True, exclude_system_pages=True):
-    LOG.debug('wiki_get_all_pages')
+def component_get_all(source, batch_size=None, pool=None, journal=None):
+    LOG.debug('component_get_all')
+    return ticket_enum_get_all(source, 'component', batch_size=batch_size, pool=pool, journal=journal)
+
+
+def version_get_all(source, batch_size=None, pool=None, journal=None):
+    LOG.debug('version_get_all')
+    return ticket_enum_get_all(source, 'version', batch_size=batch_size, pool=pool, journal=journal)
+
+
+def priority_get_all(source, batch_size=None, pool=None, journal=None):
+    LOG.debug('priority_get_all')
+    return ticket_enum_get_all(source, 'priority', batch_size=batch_size, pool=pool, journal=journal)
+
+
+def _wiki_get_page(source, pagename):
+    LOG.debug('wiki_get_all_pages is retrieving contents for wiki page %s', pagename)
+    return source.wiki.getPage(pagename)
+
+
+def _wiki_get_page_info(source, pagename):
+    return source.wiki.getPageInfo(pagename)
+
+
+def _wiki_get_attachment_data(source, filename, store=None, files=None):
+    data = _read_wiki_attachment_file(files, filename, store=store)
+    if data is not None:
+        return data
+    return _store_data(source.wiki.getAttachment(filename), store)
+
+
+def _wiki_get_attachments(source, pagename, journal=None, store=None, files=None):
+    LOG.debug('wiki_get_all_pages is retrieving attachments for wiki page %s', pagename)
+    get_data = journaled(journal, 'wiki-attachment',
+                         functools.partial(_wiki_get_attachment_data, store=store, files=files))
+    return {
+        filename: get_data(source, filename)
+            for filename in source.wiki.listAttachments(pagename)
+    }
+
+
+def _lines(text):
+    return text.splitlines(True)
+
+
+def wiki_delta(source_text, target_text):
+    """Line based delta turning ``source_text`` into ``target_text``"""
+    source_lines = _lines(source_text)
+    target_lines = _lines(target_text)
+    matcher = difflib.SequenceMatcher(None, source_lines, target_lines, autojunk=False)
+    delta = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append(''.join(target_lines[j1:j2]))
+    return delta
+
+
+def wiki_patch(text, delta):
+    """Apply a delta computed by wiki_delta to its source text"""
+    lines = _lines(text)
+    return ''.join(
+        op if isinstance(op, six.string_types) else ''.join(lines[op[0]:op[1]])
+        for op in delta
+    )
+
+
+def wiki_page_versions(page):
+    """Rebuild the ``(attributes, text)`` versions of a page crawled with history, oldest first"""
+    versions = [(page['attributes'], page['page'])]
+    text = page['page']
+    for entry in reversed(page.get('history', [])):
+        text = wiki_patch(text, entry['delta'])
+        versions.append((entry['attributes'], text))
+    versions.reverse()
+    return versions
+
+
+def wiki_history(versions):
+    """Build the ``history`` entry of a page out of all its ``(attributes, text)`` versions"""
+    history = []
+    for (info, text), (_, newer_text) in zip(versions, versions[1:]):
+        history.append({'attributes': info, 'delta': wiki_delta(newer_text, text)})
+    return history
+
+
+def _wiki_get_versions(source, pagename, versions, batch_size=None):
+    """Retrieve ``(info, text)`` pairs of the given versions of a page, skipping missing ones"""
+    LOG.debug('wiki_iter is retrieving %s old versions of wiki page %s', len(versions), pagename)
+    pages = []
+    if batch_size:
+        for chunk in _chunks(versions, batch_size):
+            results = _multicall(source, [
+                call for version in chunk for call in (
+                    ('wiki.getPageInfoVersion', (pagename, version)),
+                    ('wiki.getPageVersion', (pagename, version)),
+                )
+            ], faults=True)
+            for version, info, text in zip(chunk, results[0::2], results[1::2]):
+                if isinstance(info, xmlrpc.Fault) or isinstance(text, xmlrpc.Fault):
+                    LOG.warning('skipping version %s of wiki page %s: %s', version, pagename,
+                                info if isinstance(info, xmlrpc.Fault) else text)
+                    continue
+                pages.append((info, text))
+        return pages
+    for version in versions:
+        try:
+            # Deleted versions are common
+            with faults_expected():
+                pages.append((source.wiki.getPageInfoVersion(pagename, version),
+                              source.wiki.getPageVersion(pagename, version)))
+        except xmlrpc.Fault as e:
+            LOG.warning('skipping version %s of wiki page %s: %s', version, pagename, e)
+    return pages
+
+
+def _wiki_get_history(source, pagename, version, text, batch_size=None):
+    """History of a page whose latest ``version`` reads ``text``"""
+    versions = _wiki_get_versions(source, pagename, list(range(1, version)), batch_size=batch_size)
+    return wiki_history(versions + [(None, text)])
+
+
+def _wiki_authors_blacklist(authors_blacklist=None, exclude_system_pages=True):
     authors_blacklist = set(authors_blacklist or [])
     if exclude_system_pages:
         authors_blacklist.add('trac')
-    LOG.debug('wiki_get_all_pages is retrieving metadata for all pages')
-    pages = {
-        name: {
-            'attributes': source.wiki.getPageInfo(name),
-            'page': '',
-            'attachments': {},
-        }
-        for name in source.wiki.getAllPages()
-    }
     if authors_blacklist:
-        LOG.debug('wiki_get_all_pages is blacklisting authors: %s', authors_blacklist)
-        pages = {
-            k: v for k, v in six.iteritems(pages)
-                if v['attributes']['author'] not in authors_blacklist
+        LOG.debug('blacklisting the wiki pages of authors: %s', authors_blacklist)
+    return authors_blacklist
+
+
+def wiki_iter(source, names=None, authors_blacklist=None, contents=True, attachments=True, exclude_system_pages=True,
+              history=False, batch_size=None, pool=None, journal=None, store=None, files=None):
+    """Yield ``(pagename, page)`` pairs one at a time (all pages by default)"""
+    LOG.debug('wiki_iter')
+    if names is None:
+        names = sorted(source.wiki.getAllPages())
+    authors_blacklist = _wiki_authors_blacklist(authors_blacklist, exclude_system_pages)
+    get_info = journaled(journal, 'wiki-info', _wiki_get_page_info)
+    get_page = journaled(journal, 'wiki-page', _wiki_get_page)
+
+    def crawl(s, pagename):
+        info = get_info(s, pagename)
+        if info['author'] in authors_blacklist:
+            return None
+        page = {
+            'attributes': info,
+            'page': get_page(s, pagename) if contents else '',
+            'attachments': _wiki_get_attachments(s, pagename, journal=journal, store=store, files=files)
+                if attachments else {},
         }
-    if contents:
-        for pagename, pagedict in six.iteritems(pages):
-            LOG.debug('wiki_get_all_pages is retrieving contents for wiki page %s', pagename)
-            pagedict['page'] = source.wiki.getPage(pagename)
-    if attachments:
-        for pagename, pagedict in six.iteritems(pages):
-            LOG.debug('wiki_get_all_pages is retrieving attachments for wiki page %s', pagename)
-            pagedict['attachments'] = {
-                filename: _safe_retrieve_data(source.wiki.getAttachment(filename).data)
-                    for filename in source.wiki.listAttachments(pagename)
-            }
-    return pages
+        if history and contents:
+            get_history = journaled(journal, 'wiki-history', lambda s, key: _wiki_get_history(
+                s, key[0], key[1], page['page'], batch_size=batch_size))
+            page['history'] = get_history(s, [pagename, info['version']])
+        return page
+
+    for pagename, page in zip(names, _imap(source, pool, crawl, names)):
+        if page is not None:
+            yield pagename, page
+
+
+def wiki_get_all_pages(source, authors_blacklist=None, contents=True, attachments=True, exclude_system_pages=True,
+                       history=False, batch_size=None, pool=None, journal=None, store=None, files=None):
+    LOG.debug('wiki_get_all_pages')
+    return dict(wiki_iter(source, authors_blacklist=authors_blacklist, contents=contents, attachments=attachments,
+                          exclude_system_pages=exclude_system_pages, history=history, batch_size=batch_size,
+                          pool=pool, journal=journal, store=store, files=files))
+
+
+def wiki_get_pages(source, names, authors_blacklist=None, contents=True, attachments=True, exclude_system_pages=True,
+                   history=False, batch_size=None, pool=None, journal=None, store=None, files=None):
+    return dict(wiki_iter(source, names, authors_blacklist=authors_blacklist, contents=contents,
+                          attachments=attachments, exclude_system_pages=exclude_system_pages,
+                          history=history, batch_size=batch_size, pool=pool, journal=journal, store=store,
+                          files=files))
 
 
-def project_get(source, collect_authors=True):
+def shard_of(key, count):
+    """Stable shard of a ticket id (modulo) or of a wiki page name (hash)"""
+    if isinstance(key, six.integer_types):
+        return key % count
+    return (zlib.crc32(key.encode('utf-8')) & 0xffffffff) % count
+
+
+def in_shard(key, shard):
+    """Whether ``key`` belongs to ``shard``, an ``(index, count)`` pair (None for the whole project)"""
+    return shard is None or shard_of(key, shard[1]) == shard[0]
+
+
+def project_iter(source, collect_authors=True, batch_size=None, pool=None, journal=None, store=None, files=None,
+                 wiki_history=False, shard=None, lane=None, page_size=None, query=None):
+    """Yield the whole project one entity at a time as ``(section, key, value)`` triples"""
+    LOG.debug('project_iter')
+    pagenames = ticket_ids = None
+    if shard is not None:
+        LOG.info('project_iter is crawling shard %s/%s', *shard)
+        pagenames = [name for name in sorted(source.wiki.getAllPages()) if in_shard(name, shard)]
+        ticket_ids = (ticket_id for ticket_id in ticket_iter_ids(source, page_size=page_size, query=query)
+                      if in_shard(ticket_id, shard))
+    authors = set()
+    for pagename, page in wiki_iter(source, pagenames, history=wiki_history, batch_size=batch_size, pool=pool,
+                                    journal=journal, store=store, files=files):
+        authors.add(page['attributes']['author'])
+        yield 'wiki', pagename, page
+    for ticket_id, ticket in ticket_iter(source, ticket_ids, batch_size=batch_size, pool=pool, journal=journal,
+                                         store=store, files=files, lane=lane, page_size=page_size, query=query):
+        authors.update(_ticket_authors(ticket))
+        yield 'tickets', ticket_id, ticket
+    if shard is None or shard[0] == 0:
+        for name, milestone in milestone_iter(source, batch_size=_enum_batch_size(batch_size), pool=pool,
+                                              journal=journal):
+            yield 'milestones', name, milestone
+    if collect_authors:
+        yield 'authors', None, sorted(authors)
+
+
+def project_empty():
+    return {
+        'wiki': {},
+        'tickets': {},
+        'milestones': {},
+        'authors': [],
+    }
+
+
+def project_collect(entries):
+    """Build a project dict out of ``(section, key, value)`` entries"""
+    project = project_empty()
+    for section, key, value in entries:
+        if key is None:
+            project[section] = value
+        else:
+            project[section][key] = value
+    return project
+
+
+def project_get(source, collect_authors=True, batch_size=None, pool=None, journal=None, store=None, files=None,
+                wiki_history=False, shard=None, lane=None, page_size=None, query=None):
     LOG.debug('project_get')
+    return project_collect(project_iter(source, collect_authors=collect_authors, batch_size=batch_size,
+                                        pool=pool, journal=journal, store=store, files=files,
+                                        wiki_history=wiki_history, shard=shard, lane=lane, page_size=page_size,
+                                        query=query))
+
+
+def project_update(source, project, since, collect_authors=True, batch_size=None, pool=None, journal=None,
+                   store=None, files=None, wiki_history=False, lane=None, page_size=None, query=None):
+    """Bring a previously exported project up to date"""
+    LOG.debug('project_update since %s', since)
+    ticket_ids = list(ticket_iter_ids(source, page_size=page_size, query=query))
+    changed_ids = set(source.ticket.getRecentChanges(since)).intersection(ticket_ids)
+    LOG.info('project_update found %s tickets changed since %s', len(changed_ids), since)
+    changed = ticket_get_many(source, sorted(changed_ids), batch_size=batch_size, pool=pool,
+                              journal=journal, store=store, files=files, lane=lane)
+    tickets = {
+        ticket_id: changed[ticket_id] if ticket_id in changed else project['tickets'][ticket_id]
+            for ticket_id in ticket_ids
+            if ticket_id in changed or ticket_id in project['tickets']
+    }
+    pagenames = set(source.wiki.getAllPages())
+    changed_pagenames = set(info['name'] for info in source.wiki.getRecentChanges(since)).intersection(pagenames)
+    LOG.info('project_update found %s wiki pages changed since %s', len(changed_pagenames), since)
+    wiki = {
+        pagename: page for pagename, page in six.iteritems(project['wiki'])
+            if pagename in pagenames and pagename not in changed_pagenames
+    }
+    wiki.update(wiki_get_pages(source, sorted(changed_pagenames), history=wiki_history, batch_size=batch_size,
+                               pool=pool, journal=journal, store=store, files=files))
     project = {
-        'wiki': wiki_get_all_pages(source),
-        'tickets': ticket_get_all(source),
-        'milestones': milestone_get_all(source),
+        'wiki': wiki,
+        'tickets': tickets,
+        'milestones': milestone_get_all(source, batch_size=_enum_batch_size(batch_size), pool=pool,
+                                        journal=journal),
         'authors': [],
     }
     if collect_authors:
-        LOG.debug('project_get is collecting authors from project')
+        LOG.debug('project_update is collecting authors from project')
         project['authors'] = _authors_collect(wiki=project['wiki'], tickets=project['tickets'])
     return project
 
 
-def authors_get(source, from_wiki=True, from_tickets=True):
-    wiki = wiki_get_all_pages(source, contents=False, attachments=False) if from_wiki else None
-    tickets = ticket_get_all(source, attachments=False) if from_tickets else None
-    return _authors_collect(wiki=wiki, tickets=tickets)
+def _ticket_authors_count(source, ticket_ids, batch_size=None):
+    if batch_size:
+        results = iter(_multicall(source, [
+            call for ticket_id in ticket_ids for call in (
+                ('ticket.get', (ticket_id,)),
+                ('ticket.changeLog', (ticket_id,)),
+            )
+        ]))
+    else:
+        results = (
+            result for ticket_id in ticket_ids for result in (
+                source.ticket.get(ticket_id),
+                source.ticket.changeLog(ticket_id),
+            )
+        )
+    counts = collections.Counter()
+    for ticket, changelog in zip(results, results):
+        counts[ticket[3]['reporter']] += 1
+        counts[ticket[3]['owner']] += 1
+        counts.update(change[1] for change in changelog)
+    return counts
+
+
+def _wiki_authors_count(source, pagenames, batch_size=None, exclude_system_pages=True):
+    if batch_size:
+        infos = _multicall(source, [('wiki.getPageInfo', (pagename,)) for pagename in pagenames])
+    else:
+        infos = (source.wiki.getPageInfo(pagename) for pagename in pagenames)
+    return collections.Counter(
+        info['author'] for info in infos
+        if not (exclude_system_pages and info['author'] == 'trac')
+    )
+
+
+def authors_count(source, from_wiki=True, from_tickets=True, batch_size=None, pool=None, page_size=None):
+    """Count how many times every author shows up in the project"""
+    LOG.debug('authors_count')
+    counts = collections.Counter()
+    chunk_size = batch_size or 1
+    if from_wiki:
+        pagenames = sorted(source.wiki.getAllPages())
+        count = functools.partial(_wiki_authors_count, batch_size=batch_size)
+        for batch_counts in _imap(source, pool, count, _chunks(pagenames, chunk_size)):
+            counts.update(batch_counts)
+    if from_tickets:
+        count = functools.partial(_ticket_authors_count, batch_size=batch_size)
+        ticket_ids = ticket_iter_ids(source, page_size=page_size)
+        for batch_counts in _imap(source, pool, count, _chunks(ticket_ids, chunk_size)):
+            counts.update(batch_counts)
+    return counts
+
+
+def authors_get(source, from_wiki=True, from_tickets=True, batch_size=None, pool=None, page_size=None):
+    return sorted(authors_count(source, from_wiki=from_wiki, from_tickets=from_tickets, batch_size=batch_size,
+                                pool=pool, page_size=page_size))
 
 
-def connect(url, encoding='UTF-8', use_datetime=True, ssl_verify=True):
+def connect(url, encoding='UTF-8', use_datetime=True, ssl_verify=True, connections=None, retrier=None,
+            monitor=None, cache=None, decoder=None):
+    """Connect to a Trac XML-RPC endpoint"""
     context = None if ssl_verify else ssl._create_unverified_context()
-    return xmlrpc.ServerProxy(url, encoding=encoding, use_datetime=use_datetime, context=context)
+    transport = make_transport(url, connections=connections, retrier=retrier, monitor=monitor,
+                               use_datetime=use_datetime, context=context, decoder=decoder)
+    source = xmlrpc.ServerProxy(url, transport=transport, encoding=encoding, use_datetime=use_datetime)
+    if cache is not None:
+        return CachedSource(source, cache)
+    return source
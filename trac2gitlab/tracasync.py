@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import functools
+import collections
+
+import six
+from six.moves import xmlrpc_client as xmlrpc
+
+from .decoder import loads, stock_getparser
+from .retry import RetryPolicy, TRANSIENT_HTTP_STATUSES
+from .trac import (_attachment_attributes_from_raw, _changelog_from_raw, _chunks, _enum_batch_size, _ids_query,
+                   _multicall_params, _multicall_values, _read_attachment_file, _read_wiki_attachment_file,
+                   _store_data, _ticket_authors, _ticket_batch_calls, _ticket_batch_data_calls,
+                   _ticket_batch_from_results, _ticket_batch_pending, _ticket_batch_store, _wiki_authors_blacklist,
+                   in_shard, is_past_last_page, project_collect)
+from .transport import RequestCompression
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncSource(object):
+    """Trac XML-RPC endpoint marshalling requests itself over an aiohttp
+    session, so that hundreds of requests can be kept in flight on a single
+    event loop (at most ``concurrency`` of them at any time).
+    Transient failures are retried according to ``policy``, Faults
+    according to ``fault_policy``, responses are decoded by ``decoder``
+    (see decoder.DECODERS). Requests larger than ``encode_threshold`` bytes
+    are sent gzip compressed if ``gzip_requests`` is set, see
+    transport.RequestCompression. Meant to be used as an asynchronous
+    context manager, which owns the session::
+
+        async with connect(url) as source:
+            tickets = await ticket_get_all(source)
+    """
+
+    def __init__(self, url, concurrency=100, ssl_verify=True, encoding='UTF-8', use_datetime=True, policy=None,
+                 fault_policy=None, decoder=stock_getparser, gzip_requests=False, encode_threshold=1024):
+        self.url = url
+        self.concurrency = concurrency
+        self.ssl_verify = ssl_verify
+        self.encoding = encoding
+        self.use_datetime = use_datetime
+        self.policy = policy or RetryPolicy()
+        self.fault_policy = fault_policy or RetryPolicy(retries=1)
+        self.decoder = decoder
+        self.compression = RequestCompression(gzip_requests, encode_threshold)
+        self.session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        # Both need a running event loop
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency, ssl=None if self.ssl_verify else False),
+            headers={'Content-Type': 'text/xml', 'User-Agent': 'trac2gitlab (asyncio)'},
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _send(self, body, compress=False):
+        headers = {}
+        if compress:
+            body = xmlrpc.gzip_encode(body)
+            headers['Content-Encoding'] = 'gzip'
+        async with self._semaphore:
+            async with self.session.post(self.url, data=body, headers=headers) as response:
+                if response.status != 200:
+                    raise xmlrpc.ProtocolError(self.url, response.status, response.reason, dict(response.headers))
+                data = await response.read()
+        result, _ = loads(data, getparser=self.decoder, use_datetime=self.use_datetime)
+        return result[0]
+
+    async def _negotiated_send(self, body):
+        if not self.compression.compress(body):
+            return await self._send(body)
+        try:
+            result = await self._send(body, compress=True)
+        except xmlrpc.ProtocolError as e:
+            # Some proxies answer compressed requests with an HTTP error, try plain first
+            LOG.debug('compressed request to %s failed (%s), sending it plain', self.url, e)
+            result = await self._send(body)
+            self.compression.rejected(self.url)
+            return result
+        self.compression.accepted()
+        return result
+
+    async def call(self, method, *params, expected=None):
+        """Call ``method`` (e.g. ``'ticket.get'``) and return its result,
+        raising Fault as ServerProxy does. Faults ``expected(fault)`` is
+        true for are raised right away (see retry.faults_expected)."""
+        body = xmlrpc.dumps(params, method, encoding=self.encoding, allow_none=True).encode(self.encoding)
+        retries = {'retries': 0, 'fault_retries': 0}
+        while True:
+            try:
+                return await self._negotiated_send(body)
+            except xmlrpc.Fault as e:
+                if expected is not None and expected(e):
+                    raise
+                counter, policy, error = 'fault_retries', self.fault_policy, e
+            except (xmlrpc.ProtocolError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, xmlrpc.ProtocolError) and e.errcode not in TRANSIENT_HTTP_STATUSES:
+                    raise
+                counter, policy, error = 'retries', self.policy, e
+            if retries[counter] >= policy.retries:
+                LOG.error('%s failed after %s retries: %s', method, retries[counter], error)
+                raise error
+            delay = policy.delay(retries[counter])
+            retries[counter] += 1
+            LOG.warning('%s failed (%s), retry %s/%s in %.1fs', method, error, retries[counter], policy.retries,
+                        delay)
+            await asyncio.sleep(delay)
+
+    async def multicall(self, calls, faults=False):
+        """Same as trac._multicall: pack ``(method, args)`` calls into a
+        single ``system.multicall``"""
+        return _multicall_values(await self.call('system.multicall', _multicall_params(calls)), faults=faults)
+
+
+async def _ticket_get_attachment_data(source, ticket_id, filename, store=None, files=None):
+    data = _read_attachment_file(files, 'ticket', ticket_id, filename, store=store)
+    if data is not None:
+        return data
+    binary = await source.call('ticket.getAttachment', ticket_id, filename)
+    return _store_data(binary, store)
+
+
+async def ticket_get(source, ticket_id, attachments=True, store=None, files=None):
+    LOG.debug('ticket_get of ticket #%s', ticket_id)
+    calls = [source.call('ticket.get', ticket_id), source.call('ticket.changeLog', ticket_id)]
+    if attachments:
+        calls.append(source.call('ticket.listAttachments', ticket_id))
+    results = await asyncio.gather(*calls)
+    metas = results[2] if attachments else []
+    data = await asyncio.gather(*[
+        _ticket_get_attachment_data(source, ticket_id, meta[0], store=store, files=files) for meta in metas
+    ])
+    return {
+        'attributes': results[0][3],
+        'changelog': _changelog_from_raw(results[1]),
+        'attachments': {
+            meta[0]: {
+                'attributes': _attachment_attributes_from_raw(meta),
+                'data': value,
+            }
+            for meta, value in zip(metas, data)
+        },
+    }
+
+
+async def ticket_get_batch(source, ticket_ids, attachments=True, store=None, files=None):
+    """Same as trac.ticket_get_batch"""
+    LOG.debug('ticket_get_batch of tickets %s', ticket_ids)
+    tickets = _ticket_batch_from_results(
+        ticket_ids, await source.multicall(_ticket_batch_calls(ticket_ids, attachments)), attachments)
+    if attachments:
+        pending = _ticket_batch_pending(tickets, store=store, files=files)
+        if pending:
+            _ticket_batch_store(tickets, pending, await source.multicall(_ticket_batch_data_calls(pending)), store)
+    return tickets
+
+
+async def ticket_get_all_ids(source, query=None):
+    LOG.debug('ticket_get_all_ids')
+    return list(await source.call('ticket.query', _ids_query(query, 'max=0&order=id')))
+
+
+async def ticket_get_ids_page(source, page, page_size, query=None):
+    """Same as trac.ticket_get_ids_page"""
+    LOG.debug('ticket_get_ids_page %s (%s tickets per page)', page, page_size)
+    try:
+        return list(await source.call('ticket.query',
+                                      _ids_query(query, 'max={}&page={}&order=id'.format(page_size, page)),
+                                      expected=lambda fault: is_past_last_page(fault, page)))
+    except xmlrpc.Fault as e:
+        if not is_past_last_page(e, page):
+            raise
+        LOG.debug('ticket_get_ids_page %s: %s', page, e.faultString)
+        return []
+
+
+async def _windowed(jobs, window):
+    """Asynchronously yield ``(key, result)`` pairs of ``(key, func)`` jobs
+    in order, running at most ``window`` ``func()`` coroutines at any time"""
+    pending = collections.deque()
+    try:
+        async for key, func in jobs:
+            pending.append((key, asyncio.ensure_future(func())))
+            if len(pending) >= window:
+                key, task = pending[0]
+                result = await task
+                pending.popleft()
+                yield key, result
+        while pending:
+            key, task = pending[0]
+            result = await task
+            pending.popleft()
+            yield key, result
+    finally:
+        for _, task in pending:
+            task.cancel()
+        await jobs.aclose()
+
+
+async def ticket_iter(source, attachments=True, batch_size=None, store=None, files=None, shard=None,
+                      page_size=None, query=None, window=None):
+    """Asynchronously yield ``(ticket_id, ticket)`` pairs of every ticket
+    (of ``shard`` and matching ``query`` only, if given) in id order, one by
+    one or ``batch_size`` per multicall. At most ``window`` crawls (by
+    default the concurrency of ``source``) are scheduled at any time, so
+    that memory use does not grow with the number of tickets. If
+    ``page_size`` is given, ticket ids are enumerated one page at a time."""
+    LOG.debug('ticket_iter')
+
+    async def crawl(ids):
+        if batch_size:
+            return await ticket_get_batch(source, ids, attachments=attachments, store=store, files=files)
+        return {ids[0]: await ticket_get(source, ids[0], attachments=attachments, store=store, files=files)}
+
+    async def jobs():
+        page = 1
+        while True:
+            if page_size:
+                ids = await ticket_get_ids_page(source, page, page_size, query=query)
+            else:
+                ids = await ticket_get_all_ids(source, query=query)
+            for chunk in _chunks([ticket_id for ticket_id in ids if in_shard(ticket_id, shard)], batch_size or 1):
+                yield chunk, functools.partial(crawl, chunk)
+            if not page_size or len(ids) < page_size:
+                break
+            page += 1
+
+    async for chunk, tickets in _windowed(jobs(), window or source.concurrency):
+        for ticket_id in chunk:
+            yield ticket_id, tickets[ticket_id]
+
+
+async def ticket_get_all(source, attachments=True, batch_size=None, store=None, files=None, shard=None,
+                         page_size=None, query=None):
+    LOG.debug('ticket_get_all')
+    return {
+        ticket_id: ticket async for ticket_id, ticket in ticket_iter(
+            source, attachments=attachments, batch_size=batch_size, store=store, files=files, shard=shard,
+            page_size=page_size, query=query)
+    }
+
+
+async def ticket_enum_get_all(source, realm, batch_size=None):
+    """Same as trac.ticket_enum_get_all, batches retrieved concurrently"""
+    LOG.debug('ticket_enum_get_all of %s', realm)
+    names = list(await source.call('ticket.{}.getAll'.format(realm)))
+    method = 'ticket.{}.get'.format(realm)
+    if batch_size:
+        values = []
+        for batch in await asyncio.gather(*[
+                source.multicall([(method, (name,)) for name in chunk]) for chunk in _chunks(names, batch_size)]):
+            values.extend(batch)
+    else:
+        values = await asyncio.gather(*[source.call(method, name) for name in names])
+    return dict(zip(names, values))
+
+
+async def milestone_get_all(source, batch_size=None):
+    LOG.debug('milestone_get_all')
+    return await ticket_enum_get_all(source, 'milestone', batch_size=batch_size)
+
+
+async def _wiki_get_attachment_data(source, filename, store=None, files=None):
+    data = _read_wiki_attachment_file(files, filename, store=store)
+    if data is not None:
+        return data
+    binary = await source.call('wiki.getAttachment', filename)
+    return _store_data(binary, store)
+
+
+async def _wiki_get_attachments(source, pagename, store=None, files=None):
+    LOG.debug('wiki_get_all_pages is retrieving attachments for wiki page %s', pagename)
+    filenames = await source.call('wiki.listAttachments', pagename)
+    return dict(zip(filenames, await asyncio.gather(*[
+        _wiki_get_attachment_data(source, filename, store=store, files=files) for filename in filenames
+    ])))
+
+
+async def _wiki_get_page(source, pagename, authors_blacklist, contents=True, attachments=True, store=None,
+                         files=None):
+    info = await source.call('wiki.getPageInfo', pagename)
+    if info['author'] in authors_blacklist:
+        return None
+    page, page_attachments = await asyncio.gather(
+        source.call('wiki.getPage', pagename) if contents else _constant(''),
+        _wiki_get_attachments(source, pagename, store=store, files=files) if attachments else _constant({}),
+    )
+    return {
+        'attributes': info,
+        'page': page,
+        'attachments': page_attachments,
+    }
+
+
+async def _constant(value):
+    return value
+
+
+async def wiki_iter(source, authors_blacklist=None, contents=True, attachments=True, exclude_system_pages=True,
+                    store=None, files=None, shard=None, window=None):
+    """Same as trac.wiki_iter (no history), as an asynchronous generator
+    crawling at most ``window`` pages (by default the concurrency of
+    ``source``) at any time"""
+    LOG.debug('wiki_iter')
+    names = [name for name in sorted(await source.call('wiki.getAllPages')) if in_shard(name, shard)]
+    authors_blacklist = _wiki_authors_blacklist(authors_blacklist, exclude_system_pages)
+
+    async def jobs():
+        for name in names:
+            yield name, functools.partial(_wiki_get_page, source, name, authors_blacklist, contents=contents,
+                                          attachments=attachments, store=store, files=files)
+
+    async for name, page in _windowed(jobs(), window or source.concurrency):
+        if page is not None:
+            yield name, page
+
+
+async def wiki_get_all_pages(source, authors_blacklist=None, contents=True, attachments=True,
+                             exclude_system_pages=True, store=None, files=None, shard=None):
+    LOG.debug('wiki_get_all_pages')
+    return {
+        name: page async for name, page in wiki_iter(
+            source, authors_blacklist=authors_blacklist, contents=contents, attachments=attachments,
+            exclude_system_pages=exclude_system_pages, store=store, files=files, shard=shard)
+    }
+
+
+async def project_iter(source, collect_authors=True, batch_size=None, store=None, files=None, shard=None,
+                       page_size=None, query=None):
+    """Same as trac.project_iter (as an asynchronous generator), milestones
+    being crawled while wiki pages and tickets are"""
+    LOG.debug('project_iter')
+    milestones = None
+    if shard is None or shard[0] == 0:
+        milestones = asyncio.ensure_future(milestone_get_all(source, batch_size=_enum_batch_size(batch_size)))
+    authors = set()
+    try:
+        async for pagename, page in wiki_iter(source, store=store, files=files, shard=shard):
+            authors.add(page['attributes']['author'])
+            yield 'wiki', pagename, page
+        async for ticket_id, ticket in ticket_iter(source, batch_size=batch_size, store=store, files=files,
+                                                   shard=shard, page_size=page_size, query=query):
+            authors.update(_ticket_authors(ticket))
+            yield 'tickets', ticket_id, ticket
+        if milestones is not None:
+            for name, milestone in sorted((await milestones).items()):
+                yield 'milestones', name, milestone
+    finally:
+        if milestones is not None:
+            milestones.cancel()
+    if collect_authors:
+        yield 'authors', None, sorted(authors)
+
+
+async def project_get(source, collect_authors=True, batch_size=None, store=None, files=None, shard=None,
+                      page_size=None, query=None):
+    LOG.debug('project_get')
+    return project_collect([
+        entry async for entry in project_iter(source, collect_authors=collect_authors, batch_size=batch_size,
+                                              store=store, files=files, shard=shard, page_size=page_size,
+                                              query=query)
+    ])
+
+
+async def _with_session(source, func, *args, **kwargs):
+    async with source:
+        return await func(source, *args, **kwargs)
+
+
+def iterate(source, func, *args, **kwargs):
+    """Iterate over the asynchronous generator ``func(source, *args,
+    **kwargs)`` (e.g. project_iter) from synchronous code, on a fresh event
+    loop and within a session of ``source``. The crawl only goes on while
+    the next item is being waited for."""
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(source.__aenter__())
+        items = func(source, *args, **kwargs)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(items.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(items.aclose())
+            loop.run_until_complete(source.__aexit__(None, None, None))
+    finally:
+        loop.close()
+
+
+def run(source, func, *args, **kwargs):
+    """Run ``func(source, *args, **kwargs)`` (e.g. project_get) to
+    completion on a fresh event loop, within a session of ``source``"""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_with_session(source, func, *args, **kwargs))
+    finally:
+        loop.close()
+
+
+def connect(url, concurrency=100, ssl_verify=True, encoding='UTF-8', use_datetime=True, gzip_requests=False,
+            retries=5, fault_retries=1, decoder=stock_getparser):
+    """Asynchronous counterpart of trac.connect, see AsyncSource"""
+    if aiohttp is None:
+        raise ImportError('the asyncio crawl engine requires aiohttp (pip install trac2gitlab[async])')
+    return AsyncSource(url, concurrency=concurrency, ssl_verify=ssl_verify, encoding=encoding,
+                       use_datetime=use_datetime, policy=RetryPolicy(retries=retries),
+                       fault_policy=RetryPolicy(retries=fault_retries), decoder=decoder,
+                       gzip_requests=gzip_requests)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import errno
+import hashlib
+import logging
+
+import six
+from six.moves.urllib import parse as urllib
+
+
+LOG = logging.getLogger(__name__)
+
+
+_extension_re = re.compile(r'\.[A-Za-z0-9]+\Z')
+
+
+def _sha1(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+class AttachmentFiles(object):
+    """Attachment source reading straight from the ``files/attachments``
+    tree of a Trac environment, bypassing the base64 encoding of the
+    XML-RPC API. Both the hashed layout of Trac >= 1.0
+    (``files/attachments/<realm>/<sha1(id)[:3]>/<sha1(id)>/<sha1(filename)><.ext>``)
+    and the legacy one (``attachments/<realm>/<quoted id>/<quoted filename>``)
+    are supported.
+    """
+
+    def __init__(self, env_path):
+        self.env_path = env_path
+
+    def _hashed_path(self, realm, parent_id, filename):
+        parent_hash = _sha1(parent_id)
+        match = _extension_re.search(filename)
+        return os.path.join(
+            self.env_path, 'files', 'attachments', realm,
+            parent_hash[0:3], parent_hash,
+            _sha1(filename) + (match.group(0) if match else '')
+        )
+
+    def _legacy_path(self, realm, parent_id, filename):
+        quote = lambda value: urllib.quote(value.encode('utf-8'))
+        return os.path.join(self.env_path, 'attachments', realm, quote(parent_id), quote(filename))
+
+    def path(self, realm, parent_id, filename):
+        parent_id = six.text_type(parent_id)
+        for path in (self._hashed_path(realm, parent_id, filename),
+                     self._legacy_path(realm, parent_id, filename)):
+            if os.path.isfile(path):
+                return path
+        raise IOError(errno.ENOENT, 'attachment not found in {}'.format(self.env_path),
+                      '{}:{}/{}'.format(realm, parent_id, filename))
+
+    def open(self, realm, parent_id, filename):
+        return open(self.path(realm, parent_id, filename), 'rb')
+
+    def read(self, realm, parent_id, filename, store=None):
+        """Return the payload of an attachment or, when a blob store is
+        given, stream the file into it and return its reference"""
+        LOG.debug('reading attachment %s:%s/%s from the Trac environment', realm, parent_id, filename)
+        with self.open(realm, parent_id, filename) as f:
+            if store is not None:
+                return store.put_stream(f)
+            return f.read()
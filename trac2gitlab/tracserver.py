@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import random
+import logging
+import datetime
+import threading
+
+import six
+from six.moves import socketserver
+from six.moves import xmlrpc_client as xmlrpc
+from six.moves.xmlrpc_server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+from .trac import wiki_history, wiki_page_versions
+
+
+LOG = logging.getLogger(__name__)
+
+
+START = datetime.datetime(2010, 1, 1)
+
+WORDS = [
+    'build', 'crash', 'server', 'client', 'parser', 'timeout', 'memory', 'config', 'release', 'update',
+    'window', 'layout', 'driver', 'cache', 'thread', 'query', 'export', 'import', 'login', 'report',
+    'error', 'warning', 'option', 'format', 'plugin', 'module', 'docs', 'install', 'upgrade', 'network',
+]
+
+TICKET_TYPES = ['defect', 'enhancement', 'task']
+PRIORITIES = ['blocker', 'critical', 'major', 'minor', 'trivial']
+SEVERITIES = ['blocker', 'critical', 'major', 'normal', 'minor', 'trivial']
+COMPONENTS = ['core', 'ui', 'docs', 'build', 'network']
+VERSIONS = ['1.0', '1.1', '2.0']
+STATUSES = ['new', 'assigned', 'accepted', 'reopened', 'closed']
+RESOLUTIONS = ['fixed', 'invalid', 'wontfix', 'duplicate', 'worksforme']
+EXTENSIONS = ['.txt', '.log', '.png', '.patch', '.zip']
+SYSTEM_PAGES = ['WikiStart', 'TracGuide', 'TracAdmin', 'TracInstall', 'WikiFormatting']
+
+PAYLOAD_BLOCK_SIZE = 1 << 16
+
+
+def _query_split(text, separator):
+    """Split a Trac query string on the separators not escaped by a backslash"""
+    parts = ['']
+    escaped = False
+    for char in text:
+        if escaped:
+            parts[-1] += '\\' + char
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == separator:
+            parts.append('')
+        else:
+            parts[-1] += char
+    return parts
+
+
+def _query_unescape(value):
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+def _query_time(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ') if value else None
+
+
+def _query_match(ticket_id, attributes, field, values):
+    """Whether a ticket field matches any of the values of a query clause"""
+    for value in values:
+        if field == 'id':
+            first, _, last = value.partition('-')
+            if int(first) <= ticket_id <= int(last or first):
+                return True
+        elif field in ('time', 'changetime') and '..' in value:
+            # Trac ranges include their start but not their end
+            since, _, until = value.partition('..')
+            since, until = _query_time(since), _query_time(until)
+            if (since is None or attributes[field] >= since) and (until is None or attributes[field] < until):
+                return True
+        elif six.text_type(attributes.get(field, '')) == value:
+            return True
+    return False
+
+
+class _Generator(object):
+
+    def __init__(self, seed, users):
+        self.rng = random.Random(seed)
+        self.users = ['user{:02d}'.format(i) for i in range(users)]
+        self.block = bytes(bytearray(self.rng.getrandbits(8) for _ in range(PAYLOAD_BLOCK_SIZE)))
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def words(self, count):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(count))
+
+    def text(self, paragraphs):
+        return '\n\n'.join(
+            '{}.'.format(self.words(self.rng.randint(8, 60)).capitalize()) for _ in range(paragraphs)
+        )
+
+    def delay(self, time, days):
+        return time + datetime.timedelta(seconds=self.rng.randint(60, days * 86400))
+
+    def count(self, mean):
+        return int(self.rng.expovariate(1.0 / mean)) if mean > 0 else 0
+
+    def payload(self, size):
+        """Incompressible pseudo-random payload, sliced out of a single
+        random block so that large attachments are cheap to generate"""
+        offset = self.rng.randrange(PAYLOAD_BLOCK_SIZE)
+        repeats = (offset + size) // PAYLOAD_BLOCK_SIZE + 1
+        return (self.block * repeats)[offset:offset + size]
+
+    def edit(self, paragraphs):
+        """Replace, insert or delete a random paragraph"""
+        i = self.rng.randrange(len(paragraphs) + 1)
+        action = self.rng.choice(['replace', 'insert', 'delete'])
+        if action == 'insert' or i == len(paragraphs):
+            paragraphs.insert(i, self.text(1))
+        elif action == 'replace':
+            paragraphs[i] = self.text(1)
+        elif len(paragraphs) > 1:
+            del paragraphs[i]
+
+    def attachments(self, ratio, size, sigma, max_size):
+        count = 0
+        while self.rng.random() < ratio:
+            count += 1
+        for _ in range(count):
+            length = min(max_size, int(self.rng.lognormvariate(0, sigma) * size))
+            filename = '{}{}'.format(self.rng.choice(WORDS), self.rng.choice(EXTENSIONS))
+            yield filename, length
+
+
+def generate_project(seed=0, tickets=100, changes=5, wiki_pages=20, wiki_versions=5, milestones=5, users=20,
+                     attachment_ratio=0.2, attachment_size=16384, attachment_sigma=1.0,
+                     max_attachment_size=16 << 20):
+    """Generate a synthetic Trac project shaped like trac.project_get ones
+    (wiki history included).
+
+    The same ``seed`` always yields the same project. Every ticket gets on
+    average ``changes`` changelog entries, every wiki page ``wiki_versions``
+    versions besides the first one. Tickets and wiki pages get an attachment
+    with probability ``attachment_ratio`` (then another one with the same
+    probability, and so on) whose size is log-normally distributed around
+    ``attachment_size`` bytes.
+    """
+    LOG.debug('generate_project with seed %s', seed)
+    gen = _Generator(seed, users)
+    project = {
+        'wiki': {},
+        'tickets': {},
+        'milestones': {},
+        'authors': [],
+    }
+    milestone_names = ['milestone{}'.format(i) for i in range(1, milestones + 1)]
+    for i, name in enumerate(milestone_names):
+        due = START + datetime.timedelta(days=90 * (i + 1))
+        project['milestones'][name] = {
+            'name': name,
+            'due': due,
+            'completed': due if i < len(milestone_names) // 2 else 0,
+            'description': gen.text(1),
+        }
+    created = START
+    for ticket_id in range(1, tickets + 1):
+        created = gen.delay(created, 2)
+        reporter = gen.user()
+        attributes = {
+            'summary': gen.words(gen.rng.randint(3, 10)).capitalize(),
+            'description': gen.text(gen.rng.randint(1, 4)),
+            'type': gen.rng.choice(TICKET_TYPES),
+            'priority': gen.rng.choice(PRIORITIES),
+            'severity': gen.rng.choice(SEVERITIES),
+            'component': gen.rng.choice(COMPONENTS),
+            'version': gen.rng.choice(VERSIONS),
+            'milestone': gen.rng.choice(milestone_names) if milestone_names else '',
+            'reporter': reporter,
+            'owner': gen.user(),
+            'cc': '',
+            'keywords': gen.words(gen.rng.randint(0, 3)),
+            'status': 'new',
+            'resolution': '',
+            'time': created,
+        }
+        changelog = []
+        changed = created
+        for _ in range(gen.count(changes)):
+            changed = gen.delay(changed, 30)
+            author = gen.user()
+            if gen.rng.random() < 0.3:
+                status = gen.rng.choice(STATUSES)
+                changelog.append({
+                    'time': changed, 'author': author, 'field': 'status',
+                    'oldvalue': attributes['status'], 'newvalue': status, 'permanent': True,
+                })
+                attributes['status'] = status
+                resolution = gen.rng.choice(RESOLUTIONS) if status == 'closed' else ''
+                if resolution != attributes['resolution']:
+                    changelog.append({
+                        'time': changed, 'author': author, 'field': 'resolution',
+                        'oldvalue': attributes['resolution'], 'newvalue': resolution, 'permanent': True,
+                    })
+                    attributes['resolution'] = resolution
+            changelog.append({
+                'time': changed, 'author': author, 'field': 'comment',
+                'oldvalue': str(len([c for c in changelog if c['field'] == 'comment']) + 1),
+                'newvalue': gen.text(1), 'permanent': True,
+            })
+        attachments = {}
+        for filename, size in gen.attachments(attachment_ratio, attachment_size, attachment_sigma,
+                                              max_attachment_size):
+            changed = gen.delay(changed, 5)
+            author = gen.user()
+            attachments[filename] = {
+                'attributes': {
+                    'filename': filename,
+                    'description': gen.words(4),
+                    'size': size,
+                    'time': changed,
+                    'author': author,
+                },
+                'data': gen.payload(size),
+            }
+            changelog.append({
+                'time': changed, 'author': author, 'field': 'attachment',
+                'oldvalue': '', 'newvalue': filename, 'permanent': False,
+            })
+        attributes['changetime'] = changed
+        attributes['_ts'] = str(changed)
+        project['tickets'][ticket_id] = {
+            'attributes': attributes,
+            'changelog': changelog,
+            'attachments': attachments,
+        }
+    pagenames = SYSTEM_PAGES + [
+        '{}{}'.format(gen.rng.choice(WORDS).capitalize(), i) for i in range(wiki_pages)
+    ]
+    for pagename in pagenames:
+        system = pagename in SYSTEM_PAGES
+        modified = START
+        paragraphs = [gen.text(1) for _ in range(gen.rng.randint(1, 8))]
+        versions = []
+        for version in range(1, 2 if system else gen.count(wiki_versions) + 2):
+            modified = gen.delay(modified, 1 if system else 60)
+            if version > 1:
+                gen.edit(paragraphs)
+            versions.append(({
+                'name': pagename,
+                'comment': '' if system else gen.words(3),
+                'lastModified': modified,
+                'author': 'trac' if system else gen.user(),
+                'version': version,
+            }, '= {} =\n\n{}\n'.format(pagename, '\n\n'.join(paragraphs))))
+        project['wiki'][pagename] = {
+            'attributes': versions[-1][0],
+            'page': versions[-1][1],
+            'history': wiki_history(versions),
+            'attachments': {
+                '{}/{}'.format(pagename, filename): gen.payload(size)
+                for filename, size in gen.attachments(attachment_ratio, attachment_size, attachment_sigma,
+                                                      max_attachment_size)
+            },
+        }
+    return project
+
+
+class _RequestHandler(SimpleXMLRPCRequestHandler):
+    # Keep-alive, as Trac behind any decent web server
+    protocol_version = 'HTTP/1.1'
+    # Any path will do (/rpc, /login/rpc, ...)
+    rpc_paths = ()
+
+
+class TracServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    """Local stand-in for a Trac XML-RPC endpoint serving ``project``
+    (see generate_project), e.g. to measure crawl performance reproducibly.
+
+    Every HTTP request is delayed by ``latency`` seconds and every call
+    (including the ones packed in a ``system.multicall``) by
+    ``call_latency`` seconds. Only the subset of the Trac XML-RPC API used
+    by the crawler is implemented.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, project, host='127.0.0.1', port=0, latency=0.0, call_latency=0.0):
+        SimpleXMLRPCServer.__init__(self, (host, port), requestHandler=_RequestHandler, logRequests=False,
+                                    allow_none=True, use_builtin_types=True)
+        self.project = project
+        self.latency = latency
+        self.call_latency = call_latency
+        self._thread = None
+        self._versions = {}
+        self._versions_lock = threading.Lock()
+        self.register_multicall_functions()
+        for name, func in six.iteritems(self._api()):
+            self.register_function(func, name)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}/rpc'.format(host, port)
+
+    def start(self):
+        """Serve requests from a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name='trac-server')
+        self._thread.daemon = True
+        self._thread.start()
+        LOG.info('serving Trac stand-in at %s', self.url)
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return SimpleXMLRPCServer._marshaled_dispatch(self, data, dispatch_method, path)
+
+    def _dispatch(self, method, params):
+        if self.call_latency:
+            time.sleep(self.call_latency)
+        return SimpleXMLRPCServer._dispatch(self, method, params)
+
+    def _ticket(self, ticket_id):
+        try:
+            return self.project['tickets'][ticket_id]
+        except KeyError:
+            raise xmlrpc.Fault(404, 'Ticket {} does not exist.'.format(ticket_id))
+
+    def _page(self, pagename):
+        try:
+            return self.project['wiki'][pagename]
+        except KeyError:
+            raise xmlrpc.Fault(404, 'Wiki page "{}" does not exist'.format(pagename))
+
+    def _page_version(self, pagename, version):
+        """``(info, text)`` of a page version, history is rebuilt on demand"""
+        page = self._page(pagename)
+        if version is None or version == page['attributes']['version']:
+            return page['attributes'], page['page']
+        with self._versions_lock:
+            versions = self._versions.get(pagename)
+            if versions is None:
+                versions = self._versions[pagename] = {
+                    info['version']: (info, text) for info, text in wiki_page_versions(page)
+                }
+        try:
+            return versions[version]
+        except KeyError:
+            raise xmlrpc.Fault(404, 'Wiki page "{}" does not exist at version {}'.format(pagename, version))
+
+    def _milestone(self, name):
+        try:
+            return self.project['milestones'][name]
+        except KeyError:
+            raise xmlrpc.Fault(404, 'Milestone {} does not exist.'.format(name))
+
+    def _ticket_attachment(self, ticket_id, filename):
+        try:
+            return self._ticket(ticket_id)['attachments'][filename]
+        except KeyError:
+            raise xmlrpc.Fault(404, 'Attachment {} does not exist.'.format(filename))
+
+    def _wiki_attachment(self, path):
+        pagename, _, _ = path.rpartition('/')
+        try:
+            return self._page(pagename)['attachments'][path]
+        except KeyError:
+            raise xmlrpc.Fault(404, 'Attachment {} does not exist.'.format(path))
+
+    def ticket_query(self, qstr='status!=closed'):
+        """Subset of the Trac query language: ``field=value|value``,
+        ``field!=value``, ``id=first-last``, ``time=since..until`` (also
+        ``changetime``), ``max``, ``page``, ``order`` and ``desc``"""
+        options = {'max': '100', 'page': '1', 'order': 'priority', 'desc': '0'}
+        filters = []
+        for clause in _query_split(qstr, '&'):
+            if not clause:
+                continue
+            field, _, values = clause.partition('=')
+            if field in options:
+                options[field] = values
+                continue
+            negate = field.endswith('!')
+            filters.append((field.rstrip('!'), negate, [_query_unescape(v) for v in _query_split(values, '|')]))
+        tickets = self.project['tickets']
+        ids = [
+            ticket_id for ticket_id in tickets
+            if all(_query_match(ticket_id, tickets[ticket_id]['attributes'], field, values) != negate
+                   for field, negate, values in filters)
+        ]
+        order = options['order']
+        ids.sort(key=lambda i: (tickets[i]['attributes'].get(order, '') if order != 'id' else i, i),
+                 reverse=options['desc'] == '1')
+        limit = int(options['max'])
+        if limit > 0:
+            page = int(options['page'])
+            start = (page - 1) * limit
+            if page > 1 and start >= len(ids):
+                raise xmlrpc.Fault(1, 'Page {} is beyond the number of pages in the query'.format(page))
+            ids = ids[start:start + limit]
+        return ids
+
+    def ticket_get(self, ticket_id):
+        attributes = self._ticket(ticket_id)['attributes']
+        return [ticket_id, attributes['time'], attributes['changetime'], attributes]
+
+    def ticket_changeLog(self, ticket_id, when=0):
+        return [
+            [c['time'], c['author'], c['field'], c['oldvalue'], c['newvalue'], int(c['permanent'])]
+            for c in self._ticket(ticket_id)['changelog']
+        ]
+
+    def ticket_listAttachments(self, ticket_id):
+        return [
+            [a['filename'], a['description'], a['size'], a['time'], a['author']]
+            for a in (attachment['attributes'] for attachment in six.itervalues(self._ticket(ticket_id)['attachments']))
+        ]
+
+    def ticket_getAttachment(self, ticket_id, filename):
+        return xmlrpc.Binary(self._ticket_attachment(ticket_id, filename)['data'])
+
+    def ticket_getRecentChanges(self, since):
+        return sorted(
+            ticket_id for ticket_id, ticket in six.iteritems(self.project['tickets'])
+            if ticket['attributes']['changetime'] >= since
+        )
+
+    def milestone_getAll(self):
+        return sorted(self.project['milestones'])
+
+    def milestone_get(self, name):
+        return self._milestone(name)
+
+    def _enum(self, values, kind, name):
+        if name not in values:
+            raise xmlrpc.Fault(404, '{} {} does not exist.'.format(kind, name))
+
+    def component_getAll(self):
+        return list(COMPONENTS)
+
+    def component_get(self, name):
+        self._enum(COMPONENTS, 'Component', name)
+        return {'name': name, 'owner': '', 'description': ''}
+
+    def version_getAll(self):
+        return list(VERSIONS)
+
+    def version_get(self, name):
+        self._enum(VERSIONS, 'Version', name)
+        return {'name': name, 'time': 0, 'description': ''}
+
+    def priority_getAll(self):
+        return list(PRIORITIES)
+
+    def priority_get(self, name):
+        self._enum(PRIORITIES, 'Priority', name)
+        return str(PRIORITIES.index(name) + 1)
+
+    def wiki_getAllPages(self):
+        return sorted(self.project['wiki'])
+
+    def wiki_getPage(self, pagename, version=None):
+        return self._page_version(pagename, version)[1]
+
+    def wiki_getPageInfo(self, pagename, version=None):
+        return self._page_version(pagename, version)[0]
+
+    def wiki_listAttachments(self, pagename):
+        return sorted(self._page(pagename)['attachments'])
+
+    def wiki_getAttachment(self, path):
+        return xmlrpc.Binary(self._wiki_attachment(path))
+
+    def wiki_getRecentChanges(self, since):
+        return [
+            page['attributes'] for _, page in sorted(six.iteritems(self.project['wiki']))
+            if page['attributes']['lastModified'] >= since
+        ]
+
+    def _api(self):
+        return {
+            'ticket.query': self.ticket_query,
+            'ticket.get': self.ticket_get,
+            'ticket.changeLog': self.ticket_changeLog,
+            'ticket.listAttachments': self.ticket_listAttachments,
+            'ticket.getAttachment': self.ticket_getAttachment,
+            'ticket.getRecentChanges': self.ticket_getRecentChanges,
+            'ticket.milestone.getAll': self.milestone_getAll,
+            'ticket.milestone.get': self.milestone_get,
+            'ticket.component.getAll': self.component_getAll,
+            'ticket.component.get': self.component_get,
+            'ticket.version.getAll': self.version_getAll,
+            'ticket.version.get': self.version_get,
+            'ticket.priority.getAll': self.priority_getAll,
+            'ticket.priority.get': self.priority_get,
+            'wiki.getAllPages': self.wiki_getAllPages,
+            'wiki.getPage': self.wiki_getPage,
+            'wiki.getPageInfo': self.wiki_getPageInfo,
+            'wiki.getPageVersion': self.wiki_getPage,
+            'wiki.getPageInfoVersion': self.wiki_getPageInfo,
+            'wiki.listAttachments': self.wiki_listAttachments,
+            'wiki.getAttachment': self.wiki_getAttachment,
+            'wiki.getRecentChanges': self.wiki_getRecentChanges,
+        }
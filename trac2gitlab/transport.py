@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+import threading
+from collections import defaultdict
+
+import six
+from six.moves import xmlrpc_client as xmlrpc
+from six.moves.urllib import parse as urllib
+
+from .retry import is_transient
+
+
+LOG = logging.getLogger(__name__)
+
+
+class TransportStats(object):
+    """Thread-safe wire counters shared by all the transports of a
+    connection pool. Byte counters only account for message bodies."""
+
+    FIELDS = (
+        'requests',
+        'connections_opened',
+        'connections_reused',
+        'bytes_sent',
+        'bytes_received',
+        'bytes_decoded',
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in six.iteritems(counters):
+                self._counters[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def __str__(self):
+        counters = self.snapshot()
+        return ', '.join('{}={}'.format(name, counters[name]) for name in self.FIELDS)
+
+
+class RequestCompression(object):
+    """Decides which request bodies are sent gzip compressed: the ones
+    larger than ``threshold`` bytes, while ``enabled``.
+
+    Since HTTP has no way to advertise support for compressed requests, a
+    compressed request failing with an HTTP error is sent again plain right
+    away (before being considered for a retry, see rejected()) and, once
+    ``limit`` compressed requests in a row went through plain only,
+    compression is turned off for good. Faults are answers of Trac itself,
+    they say nothing about compression.
+    """
+
+    def __init__(self, enabled=True, threshold=1024, limit=3):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.limit = limit
+        self._rejections = 0
+        self._lock = threading.Lock()
+
+    def compress(self, request_body):
+        return self.enabled and len(request_body) > self.threshold
+
+    def accepted(self):
+        """Record that a compressed request went through"""
+        with self._lock:
+            self._rejections = 0
+
+    def rejected(self, host):
+        """Record that a compressed request failed while its plain copy went
+        through (e.g. a transient error, or a proxy not supporting them)"""
+        with self._lock:
+            self._rejections += 1
+            if not self.enabled or self._rejections < self.limit:
+                return
+            self.enabled = False
+        LOG.warning('%s rejected %s gzip compressed requests in a row, disabling request compression',
+                    host, self.limit)
+
+
+class ConnectionPool(object):
+    """Pool of idle keep-alive HTTP(S) connections, shared among the
+    transports of all the crawler workers. When ``gzip_requests`` is
+    enabled, request bodies larger than ``encode_threshold`` bytes are sent
+    gzip compressed, see RequestCompression."""
+
+    def __init__(self, gzip_requests=True, encode_threshold=1024):
+        self.compression = RequestCompression(gzip_requests, encode_threshold)
+        self.stats = TransportStats()
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, host):
+        with self._lock:
+            idle = self._idle[host]
+            return idle.pop() if idle else None
+
+    def release(self, host, connection):
+        with self._lock:
+            self._idle[host].append(connection)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, defaultdict(list)
+        for connections in six.itervalues(idle):
+            for connection in connections:
+                connection.close()
+
+
+class _CountingResponse(object):
+
+    def __init__(self, response):
+        self._response = response
+        self.count = 0
+
+    def read(self, *args):
+        data = self._response.read(*args)
+        self.count += len(data)
+        return data
+
+    def getheader(self, *args):
+        return self._response.getheader(*args)
+
+
+class _PooledTransportMixin(object):
+    """Transport drawing its connections from a shared ConnectionPool
+    and negotiating gzip compression in both directions. If a ``retrier``
+    (see retry.Retrier) is given, every request goes through it. If a
+    ``monitor`` is given, the latency of every attempt is reported to its
+    ``observe(latency, success)`` method (transient errors are failures).
+    Responses are decoded by the ``decoder`` ``(parser, unmarshaller)``
+    factory, if given (see decoder.DECODERS)."""
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, connections, retrier=None, monitor=None, decoder=None, **kwargs):
+        super(_PooledTransportMixin, self).__init__(**kwargs)
+        self.connections = connections
+        self.retrier = retrier
+        self.monitor = monitor
+        self.decoder = decoder
+        self._plain = False
+
+    def _compress(self, request_body):
+        return not self._plain and self.connections.compression.compress(request_body)
+
+    def _release(self):
+        host, connection = self._connection
+        self._connection = (None, None)
+        if connection is not None:
+            self.connections.release(host, connection)
+
+    def request(self, host, handler, request_body, verbose=False):
+        if self.retrier is None:
+            return self._monitored_request(host, handler, request_body, verbose)
+        return self.retrier.call(self._monitored_request, host, handler, request_body, verbose)
+
+    def _monitored_request(self, host, handler, request_body, verbose=False):
+        if self.monitor is None:
+            return self._negotiated_request(host, handler, request_body, verbose)
+        start = time.time()
+        try:
+            result = self._negotiated_request(host, handler, request_body, verbose)
+        except Exception as e:
+            self.monitor.observe(time.time() - start, success=not is_transient(e))
+            raise
+        self.monitor.observe(time.time() - start)
+        return result
+
+    def _negotiated_request(self, host, handler, request_body, verbose=False):
+        if not self._compress(request_body):
+            return super(_PooledTransportMixin, self).request(host, handler, request_body, verbose)
+        try:
+            result = super(_PooledTransportMixin, self).request(host, handler, request_body, verbose)
+        except xmlrpc.ProtocolError as e:
+            # Some proxies answer compressed requests with an HTTP error, try plain first
+            LOG.debug('compressed request to %s failed (%s), sending it plain', host, e)
+            self._plain = True
+            try:
+                result = super(_PooledTransportMixin, self).request(host, handler, request_body, verbose)
+            finally:
+                self._plain = False
+            self.connections.compression.rejected(host)
+            return result
+        self.connections.compression.accepted()
+        return result
+
+    def single_request(self, host, handler, request_body, verbose=False):
+        try:
+            result = super(_PooledTransportMixin, self).single_request(host, handler, request_body, verbose)
+        except xmlrpc.Fault:
+            # The response has been read entirely, the connection is still good
+            self._release()
+            raise
+        except xmlrpc.ProtocolError:
+            self.close()
+            raise
+        self._release()
+        return result
+
+    def make_connection(self, host):
+        connection = self.connections.acquire(host)
+        if connection is None:
+            self._connection = (None, None)
+            connection = super(_PooledTransportMixin, self).make_connection(host)
+        else:
+            _, self._extra_headers, _ = self.get_host_info(host)
+            self._connection = host, connection
+        if connection.sock is None:
+            self.connections.stats.add(connections_opened=1)
+        else:
+            self.connections.stats.add(connections_reused=1)
+        return connection
+
+    def send_content(self, connection, request_body):
+        if self._compress(request_body):
+            connection.putheader('Content-Encoding', 'gzip')
+            request_body = xmlrpc.gzip_encode(request_body)
+        connection.putheader('Content-Length', str(len(request_body)))
+        connection.endheaders(request_body)
+        self.connections.stats.add(requests=1, bytes_sent=len(request_body))
+
+    def getparser(self):
+        if self.decoder is None:
+            return super(_PooledTransportMixin, self).getparser()
+        return self.decoder(use_datetime=self._use_datetime)
+
+    def parse_response(self, response):
+        counted = _CountingResponse(response)
+        if response.getheader('Content-Encoding', '') == 'gzip':
+            stream = xmlrpc.GzipDecodedResponse(counted)
+        else:
+            stream = counted
+        parser, unmarshaller = self.getparser()
+        decoded = 0
+        for data in iter(lambda: stream.read(self.CHUNK_SIZE), b''):
+            decoded += len(data)
+            parser.feed(data)
+        if stream is not counted:
+            stream.close()
+        parser.close()
+        self.connections.stats.add(bytes_received=counted.count, bytes_decoded=decoded)
+        return unmarshaller.close()
+
+
+class Transport(_PooledTransportMixin, xmlrpc.Transport):
+    pass
+
+
+class SafeTransport(_PooledTransportMixin, xmlrpc.SafeTransport):
+    pass
+
+
+def make_transport(url, connections=None, retrier=None, monitor=None, use_datetime=True, context=None, decoder=None):
+    connections = connections if connections is not None else ConnectionPool()
+    if urllib.urlparse(url).scheme == 'https':
+        return SafeTransport(connections, retrier=retrier, monitor=monitor, decoder=decoder,
+                             use_datetime=use_datetime, context=context)
+    return Transport(connections, retrier=retrier, monitor=monitor, decoder=decoder, use_datetime=use_datetime)